@@ -5,9 +5,15 @@ import pandas as pd
 import re
 import datetime as dt
 
+from psp_datasets import load_dataset
+
 """ Open the TSV file,
  - clean up the fields
  - add column ROLE : moderation, question, answer
+
+ psp_datasets is in the src directory, run from helper_scripts with
+
+    PYTHONPATH=../src python gov_conferences_process_tsv.py
 """
 
 
@@ -109,7 +115,7 @@ def correct_wrong_dates(data):
  
 if __name__ == "__main__":
 
-    data = pd.read_csv("../data/conferences_2020.tsv.xz", sep='\t', header=0, parse_dates=["date"], compression="xz", encoding="utf-8")
+    data = load_dataset("../data/conferences_2020.tsv.xz", parse_dates=["date"])
 
     data = add_role_to_dataframe(data)
     data = correct_wrong_dates(data)
@@ -1,15 +1,69 @@
 
 from .MorphoditaNltkTokenizer import *
 from nltk.corpus.reader.tagged import TaggedCorpusReader, TaggedCorpusView
-from nltk.corpus.reader.util import read_blankline_block
+from nltk.corpus.reader.util import read_blankline_block, StreamBackedCorpusView, concat
 import re
 
 
+class MorphoditaCorpusView(StreamBackedCorpusView):
+    """
+    A lazy view of a file of the corpus. The file is read and tagged one
+    block of paragraphs at a time when the view is accessed, only the
+    positions of the blocks already read are kept in memory.
+    """
+    # what the view returns for every paragraph
+    WORDS, SENTS, TAGGED_WORDS, TAGGED_SENTS = range(4)
+
+    def __init__(self, corpus_file, encoding, tokenizer, para_block_reader,
+                 mode, lemma=False):
+        """
+        :param corpus_file: path of the file
+        :param encoding: encoding of the file
+        :param tokenizer: the Morphodita tokenizer
+        :param para_block_reader: the block reader that divides the file into paragraphs
+        :param mode: one of WORDS, SENTS, TAGGED_WORDS or TAGGED_SENTS
+        :param lemma: if true, then use word lemmas instead of word strings
+        """
+        self._tokenizer = tokenizer
+        self._para_block_reader = para_block_reader
+        self._mode = mode
+        self._lemma = lemma
+        StreamBackedCorpusView.__init__(self, corpus_file, encoding=encoding)
+
+    def read_block(self, stream):
+        # each paragraph of the corpus is analyzed once, caching it would only
+        # evict the analyses shared by the tokenizer methods
+        block = []
+        for para_str in self._para_block_reader(stream):
+            if para_str.strip() == "":
+                continue
+
+            if self._mode in (self.WORDS, self.SENTS):
+                tagged = self._tokenizer.analyze(para_str, tag=False, cache=False)
+                if self._mode == self.WORDS:
+                    block.extend(tagged.words())
+                else:
+                    block.extend(tagged.words(start, end) for start, end in tagged.sentence_ranges())
+                continue
+
+            tagged = self._tokenizer.analyze(para_str, cache=False)
+            words = tagged.lemmas if self._lemma else tagged.words()
+            if self._mode == self.TAGGED_WORDS:
+                block.extend(zip(words, tagged.tags))
+            else:
+                block.extend(list(zip(words[start:end], tagged.tags[start:end]))
+                             for start, end in tagged.sentence_ranges())
+        return block
+
+
 class MorphoditaNltkCorpusReader(TaggedCorpusReader):
     """
     Reader for corpora that consist of plaintext documents.  Paragraphs
     are assumed to be split using blank lines.  Sentences and words can
     be tokenized using the Morphodita tokenizer passed in the constructor.
+
+    The methods return lazy corpus views, the files are tagged block by
+    block while the views are iterated.
     """
     def __init__(self,
                  root,
@@ -38,67 +92,32 @@ class MorphoditaNltkCorpusReader(TaggedCorpusReader):
         self._para_block_reader=para_block_reader
 
 
-    def _words(self, fileids):
-        """
-        :return: the given file(s) as a list of words and punctuation symbols.
-        :rtype: generator(str)
-        """
-        if type(fileids) == str:
+    def _views(self, fileids, mode, lemma=False):
+        if fileids is None:
+            fileids = self._fileids
+        elif isinstance(fileids, str):
             fileids = [fileids]
-        for fileid in fileids:
-            for w in self.tokenizer.tokenize(self.raw(fileid)):
-                yield w
-        
-    def words(self, fileids):
+        return concat([MorphoditaCorpusView(path, enc, self.tokenizer,
+                                            self._para_block_reader, mode, lemma)
+                       for (path, enc) in self.abspaths(fileids, True)])
+
+    def words(self, fileids=None):
         """
         :return: the given file(s) as a list of words and punctuation symbols.
         :rtype: list(str)
         """
-        return list(self._words(fileids))
-
-    def _sents(self, fileids):
-        """
-        :return: the given file(s) as a genertor of
-            sentences or utterances, each encoded as a list of word
-            strings.
-        :rtype: generator(list(str))
-        """
-        if type(fileids) == str:
-            fileids = [fileids]
-        for fileid in fileids:
-            for s in self.tokenizer.tokenize_sents(self.raw(fileids)):
-                yield s
+        return self._views(fileids, MorphoditaCorpusView.WORDS)
 
-    
-    def sents(self, fileids):
+    def sents(self, fileids=None):
         """
         :return: the given file(s) as a list of
             sentences or utterances, each encoded as a list of word
             strings.
         :rtype: list(list(str))
         """
-        return list(self._sents(fileids))
-        
-    def _tagged_words(self, fileids, lemma=False):
-        """
-        :return: the given file(s) as a list of tagged
-            words and punctuation symbols, encoded as tuples
-            ``(word,tag)``.
-        :rtype: generator(tuple(str,str))
-
-        :param lemma: If true, then use word lemmas instead of word strings.
-        """
-        if type(fileids) == str:
-            fileids = [fileids]
-        for fileid in fileids:
-            for w in self.tokenizer.lemmatize(self.raw(fileid)):
-                if lemma:
-                    yield (w[2],w[1])
-                else:
-                    yield (w[0],w[1])
-                    
+        return self._views(fileids, MorphoditaCorpusView.SENTS)
 
-    def tagged_words(self, fileids, lemma=False):
+    def tagged_words(self, fileids=None, lemma=False):
         """
         :return: the given file(s) as a list of tagged
             words and punctuation symbols, encoded as tuples
@@ -107,26 +126,9 @@ class MorphoditaNltkCorpusReader(TaggedCorpusReader):
 
         :param lemma: If true, then use word stems instead of word strings.
         """
-        return [w for w in self._tagged_words(fileids, lemma)]
-    
-
-    def _tagged_sents(self, fileids, lemma=False):
-        """
-        :return: the given file(s) as a generator of sentences or utterances, 
-            each encoded as a list of tagged words and punctuation symbols, 
-            encoded as tuples ``(word,tag)``.
-        :rtype: generator(tuple(str,str))
-
-        :param lemma: If true, then use word stems instead of word strings.
-        """
-        if type(fileids) == str:
-            fileids = [fileids]
-        for fileid in fileids:
-            for s in self.tokenizer.pos_tag_sents(self.raw(fileids)):
-                yield s
-
+        return self._views(fileids, MorphoditaCorpusView.TAGGED_WORDS, lemma)
 
-    def tagged_sents(self, fileids, lemma=False):
+    def tagged_sents(self, fileids=None, lemma=False):
         """
         :return: the given file(s) as a list of sentences or utterances, 
             each encoded as a list of tagged words and punctuation symbols, 
@@ -135,4 +137,4 @@ class MorphoditaNltkCorpusReader(TaggedCorpusReader):
 
         :param lemma: If true, then use word stems instead of word strings.
         """
-        return [s for s in self._tagged_sents(fileids, lemma)]
+        return self._views(fileids, MorphoditaCorpusView.TAGGED_SENTS, lemma)
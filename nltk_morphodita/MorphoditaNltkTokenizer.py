@@ -11,7 +11,12 @@
 from nltk.tokenize.api import TokenizerI
 from ufal.morphodita import *
 from pathlib import Path
+from array import array
+from collections import OrderedDict, deque
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
 import os
+import threading
 
 DICT_FILENAME = os.path.join(os.path.dirname(__file__), 'czech-morfflex-161115.dict')
 TAGGER_FILENAME = os.path.join(os.path.dirname(__file__), 'czech-morfflex-pdt-161115.tagger')
@@ -22,26 +27,181 @@ class MorphoditaNltkTokenizerException(Exception):
     """MorphoditaNtlkTokenizer exceptions"""
     pass
 
+
+class InternedStrings(Sequence):
+    """
+    Read only sequence of strings stored as ids into a table of the distinct
+    strings, the strings are looked up when they are accessed
+    """
+    __slots__ = ('ids', 'names')
+
+    def __init__(self, ids, names):
+        self.ids = ids
+        self.names = names
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.names[i] for i in self.ids[index]]
+        return self.names[self.ids[index]]
+
+    def __iter__(self):
+        names = self.names
+        return (names[i] for i in self.ids)
+
+
+class Interner:
+    """Assigns consecutive ids to the distinct strings"""
+    __slots__ = ('index', 'ids')
+
+    def __init__(self):
+        self.index = {}
+        self.ids = array('i')
+
+    def append(self, name):
+        self.ids.append(self.index.setdefault(name, len(self.index)))
+
+    def strings(self):
+        return InternedStrings(self.ids, tuple(self.index))
+
+
+class TaggedText:
+    """
+    Result of tagging a text. The start and end offsets of the tokens and
+    the index of the token after the last token of every sentence are kept
+    in int arrays, the words are sliced from the text when they are used.
+    The tags and lemmas are ids into a table of the distinct tags and lemmas
+    of the text, they are None if the text was only tokenized.
+    """
+    __slots__ = ('text', 'starts', 'ends', 'sentence_ends', 'tags', 'lemmas')
+
+    def __init__(self, text, starts, ends, sentence_ends, tags=None, lemmas=None):
+        """
+        :param text: the text
+        :param starts: array of the token start offsets
+        :param ends: array of the token end offsets
+        :param sentence_ends: array of the sentence ends, in tokens
+        :param tags: InternedStrings with the tags
+        :param lemmas: InternedStrings with the lemmas
+        """
+        self.text = text
+        self.starts = starts
+        self.ends = ends
+        self.sentence_ends = sentence_ends
+        self.tags = tags
+        self.lemmas = lemmas
+
+    def __len__(self):
+        return len(self.starts)
+
+    def word(self, index):
+        return self.text[self.starts[index]:self.ends[index]]
+
+    def words(self, start=0, end=None):
+        """
+        :return: the tokens of the text, or of the tokens start to end
+        :rtype: list(str)
+        """
+        text = self.text
+        return [text[s:e] for s, e in zip(self.starts[start:end], self.ends[start:end])]
+
+    def spans(self, start=0, end=None):
+        """
+        :return: the start and end offsets of the tokens
+        :rtype: list(tuple(int,int))
+        """
+        return list(zip(self.starts[start:end], self.ends[start:end]))
+
+    def sentence_ranges(self):
+        """
+        :return: the first and last + 1 token index of every sentence
+        :rtype: generator(tuple(int,int))
+        """
+        start = 0
+        for end in self.sentence_ends:
+            yield (start, end)
+            start = end
+
+
+# Models and tokenizer shared by the whole process, loaded on first use
+_taggers = {}
+_tokenizer = None
+_lock = threading.Lock()
+
+
+def load_tagger(tagger_path=TAGGER_FILENAME):
+    """
+    Loads a MorphoDiTa tagger once per process, the tagger carries its own
+    morphological dictionary
+    """
+    with _lock:
+        if tagger_path not in _taggers:
+            tagger = Tagger.load(tagger_path)
+            if tagger is None:
+                raise MorphoditaNltkTokenizerException(
+                    "ERROR: Did not load the tagger {}".format(tagger_path))
+            _taggers[tagger_path] = tagger
+        return _taggers[tagger_path]
+
+
+def get_tokenizer():
+    """
+    :return: the MorphoditaNltkTokenizer of the process, it is created on
+        the first call
+    :rtype: MorphoditaNltkTokenizer
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        tokenizer = MorphoditaNltkTokenizer()
+        with _lock:
+            if _tokenizer is None:
+                _tokenizer = tokenizer
+    return _tokenizer
+
+
+# Tokenizer of the processes of MorphoditaNltkTokenizer.tag_many
+_worker_tokenizer = None
+
+
+def _init_worker():
+    global _worker_tokenizer
+    _worker_tokenizer = get_tokenizer()
+
+
+def _tag_texts(texts):
+    return [_worker_tokenizer.analyze(text, cache=False) for text in texts]
+
+
 class MorphoditaNltkTokenizer(TokenizerI):
     """
     A class for word tokenization using Morphodita tokenizer model
     """
-    def __init__(self, repp_dir='./', encoding='utf8'):
+    def __init__(self, repp_dir='./', encoding='utf8', cache_chars=1000000):
+        """
+        :param cache_chars: the analyses of the last texts are kept until
+            their total length exceeds cache_chars characters, 0 disables
+            the cache
+        """
         # Set an encoding for the input strings.
         self.encoding = encoding
 
+        # LRU cache of the analyses, indexed by text
+        self.cache_chars = cache_chars
+        self._analyses = OrderedDict()
+        self._cached_chars = 0
+
         self.dict_path = DICT_FILENAME
         self.tagger_path = TAGGER_FILENAME
 
-       
-        self.morpho = Morpho.load(self.dict_path)
+        # the dictionary of the tagger is used, it is the same as dict_path
+        self.tagger = load_tagger(self.tagger_path)
+        self.morpho = self.tagger.getMorpho()
         if None == self.morpho:
             raise MorphoditaNltkTokenizerException(
                 "ERROR: Did not load the dictiorary")
-        
-        
-        self.tagger = Tagger.load(self.tagger_path)
-        
+
         self.forms = Forms()
         self.tokenRanges = TokenRanges()
         self.taggedLemmas = TaggedLemmas()
@@ -54,114 +214,157 @@ class MorphoditaNltkTokenizer(TokenizerI):
         self.text = ""
 
     def tokenize(self, text):
-        if text == "":
-            #raise ValueError("Text field is empty")
-            self._init()
-            
-        self._tokenize(text)
-
-        return self.tok_words
+        return self.analyze(text, tag=False).words()
 
     def tokenize_sents(self, text):
         if text == "":
             raise ValueError("Text field is empty")
 
-        self._tokenize(text)
-        
-        for sen in self.tok_sents:
-            yield sen
+        tagged = self.analyze(text, tag=False)
+        for start, end in tagged.sentence_ranges():
+            yield tagged.words(start, end)
 
     
     def span_tokenize(self, text):
         if text == "":
             raise ValueError("Text field is empty")
 
-        self._tokenize(text)
-
-        for word in self.tok_words_pos:
+        tagged = self.analyze(text, tag=False)
+        for word in zip(tagged.starts, tagged.ends):
             yield word
 
     def span_tokenize_sents(self, text):
         if text == "":
             raise ValueError("Text field is empty")
 
-        self._tokenize(text)
-
-        for sen in self.tok_sens_pos:
-            yield sen
-            
-    def _init(self):
-        self.tok_words = []
-        self.tok_words_pos = []
-        self.tok_lemmas = []
-        self.tok_sents = []
-        self.tok_sents_pos = []
-        self.tag_words = []
-        self.tag_sents = []
+        tagged = self.analyze(text, tag=False)
+        for start, end in tagged.sentence_ranges():
+            yield tagged.spans(start, end)
             
-    def _tokenize(self, text, tag=False):
-        
-        self.tokenizer.setText(text)
+    def tag_many(self, texts, processes=None, chunksize=16):
+        """
+        Tags many texts, the tokenizer and the forms, token ranges and
+        lemmas buffers are reused for all of them. The analyses are not
+        kept in the cache. With processes the texts are sent in chunks and
+        at most 2 * processes chunks are pending, so the texts are read as
+        they are tagged.
+
+            >>> for tagged in morphodita_tokenizer.tag_many(df.text, processes=4): # doctest: +SKIP
+            ...     print(len(tagged), tagged.words()[:5])
+
+        :param texts: iterable of the texts to tag
+        :param processes: number of processes that tag the texts, each one
+            loads its own tagger. None or 1 tags the texts in this process.
+        :param chunksize: number of texts sent to a process at a time
+        :return: one ``TaggedText`` per text, in the order of the texts
+        :rtype: generator(TaggedText)
+        """
+        if processes is None or processes <= 1:
+            for text in texts:
+                yield self.analyze(text, cache=False)
+            return
+
+        texts = iter(texts)
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker) as pool:
+            while True:
+                while len(pending) < 2 * processes:
+                    chunk = [text for _, text in zip(range(chunksize), texts)]
+                    if len(chunk) == 0:
+                        break
+                    pending.append(pool.submit(_tag_texts, chunk))
+                if len(pending) == 0:
+                    break
+                for tagged in pending.popleft().result():
+                    yield tagged
+
+    def analyze(self, text, tag=True, cache=True):
+        """
+        Tokenizes and tags a text in one pass. The tokenize, pos_tag and
+        lemmatize methods are built on it, the analyses of the last texts
+        are cached so the methods called on the same text share one pass.
+
+            >>> tagged = morphodita_tokenizer.analyze("Dobrý den.") # doctest: +SKIP
+            >>> tagged.words(), list(tagged.tags), list(tagged.lemmas) # doctest: +SKIP
+
+        :param text: the text
+        :param tag: if False the text is only tokenized, the tags and lemmas
+            of the result are None. An analysis with tags also serves the
+            requests without tags.
+        :param cache: if False the analysis is not stored in the cache
+        :return: the tokens, sentences, tags and lemmas of the text
+        :rtype: TaggedText
+        """
+        tagged = self._analyses.get(text)
+        if tagged is not None and (tagged.tags is not None or not tag):
+            self._analyses.move_to_end(text)
+            return tagged
+
+        starts = array('i')
+        ends = array('i')
+        sentence_ends = array('i')
+        tags = Interner()
+        lemmas = Interner()
 
-        self._init()
-
-        sent_start = 0
-        sent_end = 0
-        sent = []
-        sent_pos = []
-        sent_tag = []
+        self.tokenizer.setText(text)
         while self.tokenizer.nextSentence(self.forms, self.tokenRanges):
-            self.tagger.tag(self.forms, self.taggedLemmas)
-            for i, (taggedLemma, tokenRange) in enumerate(zip(self.taggedLemmas, self.tokenRanges)):
-
-                token_range_end = tokenRange.start + tokenRange.length
-
-                word = f"{text[tokenRange.start : token_range_end]}"
-                word_range = (tokenRange.start, token_range_end)
-                
-                self.tok_lemmas.append(taggedLemma.lemma)
-                self.tag_words.append(taggedLemma.tag)
-                self.tok_words.append(word)
-                self.tok_words_pos.append(word_range)
-                
-                if i == 0:
-                    sent_start = tokenRange.start
-                    sent = [word]
-                    sent_pos = [word_range]
-                    sent_tag = [(word, taggedLemma.tag)]
-                else:
-                    sent.append(word)
-                    sent_pos.append(word_range)
-                    sent_tag.append((word, taggedLemma.tag))
-
-                if i+1 == len(self.taggedLemmas):
-                    self.tok_sents.append(sent)
-                    self.tok_sents_pos.append(sent_pos)
-                    self.tag_sents.append(sent_tag)
+            for tokenRange in self.tokenRanges:
+                starts.append(tokenRange.start)
+                ends.append(tokenRange.start + tokenRange.length)
+            if tag:
+                self.tagger.tag(self.forms, self.taggedLemmas)
+                for taggedLemma in self.taggedLemmas:
+                    lemmas.append(taggedLemma.lemma)
+                    tags.append(taggedLemma.tag)
+            sentence_ends.append(len(starts))
+
+        if tag:
+            tagged = TaggedText(text, starts, ends, sentence_ends, tags.strings(), lemmas.strings())
+        else:
+            tagged = TaggedText(text, starts, ends, sentence_ends)
+        if cache:
+            self._cache_analysis(tagged)
+        return tagged
+
+    def _cache_analysis(self, tagged):
+        if len(tagged.text) > self.cache_chars:
+            return
+
+        previous = self._analyses.pop(tagged.text, None)
+        if previous is not None:
+            self._cached_chars -= len(previous.text)
+        self._analyses[tagged.text] = tagged
+        self._cached_chars += len(tagged.text)
+
+        while self._cached_chars > self.cache_chars:
+            (text, _) = self._analyses.popitem(last=False)
+            self._cached_chars -= len(text)
+
+    def clear_cache(self):
+        """Removes the cached analyses"""
+        self._analyses.clear()
+        self._cached_chars = 0
 
     def pos_tag(self, text):
         if text == "":
             raise ValueError("Text field is empty")
 
-        self._tokenize(text)
-
-        for word_tag in zip(self.tok_words, self.tag_words):
-            yield word_tag
+        tagged = self.analyze(text)
+        for i, tag in enumerate(tagged.tags):
+            yield (tagged.word(i), tag)
 
     def pos_tag_sents(self, text):
         if text == "":
             raise ValueError("Text field is empty")
 
-        self._tokenize(text)
-
-        for word_tag in self.tag_sents:
-            yield word_tag
+        tagged = self.analyze(text)
+        for start, end in tagged.sentence_ranges():
+            yield list(zip(tagged.words(start, end), tagged.tags[start:end]))
 
     def lemmatize(self, text):
         if text == "":
             raise ValueError("Text field is empty")
 
-        self._tokenize(text)
-
-        for lemma in zip(self.tok_words, self.tag_words, self.tok_lemmas):
-            yield lemma
+        tagged = self.analyze(text)
+        for i, (tag, lemma) in enumerate(zip(tagged.tags, tagged.lemmas)):
+            yield (tagged.word(i), tag, lemma)
@@ -9,13 +9,23 @@
 
 """
 Compatibility exetensions for NLTK for Morphodita dictiorary and tagger.
+
+The models are loaded the first time ``morphodita_tokenizer`` is used, the
+tokenizer is shared by the whole process.
 """
 
 from .MorphoditaNltkTokenizer import MorphoditaNltkTokenizer
 from .MorphoditaNltkTokenizer import MorphoditaNltkTokenizerException
+from .MorphoditaNltkTokenizer import TaggedText
+from .MorphoditaNltkTokenizer import get_tokenizer
 from .MorphoditaNltkCorpusReader import MorphoditaNltkCorpusReader
 
 __all__ = ['MorphoditaNltkTokenizer', 'MorphoditaNltkTokenizerException',
-           'MorphoditaNltkCorpusReader']
+           'MorphoditaNltkCorpusReader', 'TaggedText', 'get_tokenizer']
+
 
-morphodita_tokenizer = MorphoditaNltkTokenizer()
+def __getattr__(name):
+    # morphodita_tokenizer is created on first access instead of on import
+    if name == 'morphodita_tokenizer':
+        return get_tokenizer()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
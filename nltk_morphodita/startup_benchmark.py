@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Natural Language Toolkit Extensions: startup time of nltk_morphodita
+#
+# Copyright (C) 2019 Manuel Berrocal
+# Authors: Manuel Berrocal
+#
+# URL: <https://github.com/mbercas/psp_cz>
+# For license information, see LICENSE.TXT
+
+"""
+Measures the time and memory used to import nltk_morphodita and to tag the
+first text, every measurement runs in a new interpreter.
+
+    python -m nltk_morphodita.startup_benchmark
+"""
+
+import subprocess
+import sys
+
+IMPORT = """
+import resource, time
+start = time.perf_counter()
+import nltk_morphodita
+print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+FIRST_USE = """
+import resource, time
+start = time.perf_counter()
+from nltk_morphodita import morphodita_tokenizer
+morphodita_tokenizer.tokenize("Dobrý den, vážené paní poslankyně.")
+print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def measure(code, repeat=3):
+    """
+    :return: the best time in seconds and the largest peak RSS in MB
+    :rtype: tuple(float,float)
+    """
+    times = []
+    rss = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", code], check=True,
+                             capture_output=True, text=True).stdout.split()
+        times.append(float(out[0]))
+        rss.append(int(out[1]) / 1024)
+    return (min(times), max(rss))
+
+
+if __name__ == "__main__":
+    for name, code in (("import", IMPORT), ("import + first tokenize", FIRST_USE)):
+        (seconds, mb) = measure(code)
+        print("{:>25}: {:7.3f}s  peak RSS {:7.1f} MB".format(name, seconds, mb))
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Natural Language Toolkit Extensions: throughput of MorphoditaNltkTokenizer.tag_many
+#
+# Copyright (C) 2019 Manuel Berrocal
+# Authors: Manuel Berrocal
+#
+# URL: <https://github.com/mbercas/psp_cz>
+# For license information, see LICENSE.TXT
+
+"""
+Measures the texts and tokens tagged per second by tag_many in this process
+and with pools of processes, the time to start the pool is included.
+
+    python -m nltk_morphodita.tag_many_benchmark
+"""
+
+import time
+
+from nltk_morphodita import morphodita_tokenizer
+
+SENTENCES = [
+    "Dobrý den, vážené paní poslankyně, vážení páni poslanci.",
+    "Zahajuji schůzi Poslanecké sněmovny a všechny vás vítám.",
+    "Návrh zákona byl přikázán k projednání rozpočtovému výboru.",
+    "Prosím pana ministra, aby se ujal slova.",
+    "Hlasování číslo 12, přihlášeno je 180 poslanců, pro 95, proti 40.",
+]
+
+
+def make_texts(count, sentences=20):
+    """Returns count different texts of the given number of sentences"""
+    return ["{}. {}".format(i, " ".join(SENTENCES[(i + j) % len(SENTENCES)]
+                                        for j in range(sentences)))
+            for i in range(count)]
+
+
+def measure(texts, processes):
+    """
+    :return: texts and tokens tagged per second
+    :rtype: tuple(float,float)
+    """
+    start = time.perf_counter()
+    tokens = sum(len(tagged) for tagged in morphodita_tokenizer.tag_many(texts, processes))
+    seconds = time.perf_counter() - start
+    return (len(texts) / seconds, tokens / seconds)
+
+
+if __name__ == "__main__":
+    texts = make_texts(2000)
+    for processes in (1, 2, 4):
+        (texts_s, tokens_s) = measure(texts, processes)
+        print("{:>2} processes: {:9.1f} texts/s {:10.1f} tokens/s".format(processes, texts_s, tokens_s))
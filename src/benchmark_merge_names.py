@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: benchmark_merge_names
+
+   :synopsis: Compares GeneratePandasDataFrame.merge_names_information with
+              the loop it replaced, one group of .loc assignments per
+              speaker. Both versions merge the speakers metadata of a period
+              into its files summary, the script checks that the data frames
+              are equal and prints the time of each version.
+
+    python benchmark_merge_names.py -s ../metadata/file_summary_1993.tvs -n ../metadata/speakers_summary_1993.tsv
+
+   The texts are not read, the text and tokens columns are left empty.
+
+.. moduleauthor:: Manuel Berrocal <mbercas@gmail.com>
+
+"""
+"""
+GNU General Public License v3.0
+Permissions of this strong copyleft license are conditioned on making available complete source code of licensed works and modifications, which include larger works using a licensed work, under the same license. Copyright and license notices must be preserved. Contributors provide an express grant of patent rights.
+"""
+
+from pathlib import Path
+import argparse
+import sys
+import time
+
+import pandas as pd
+
+from generate_pandas import GeneratePandasDataFrame
+
+METADATA_DIRECTORY = Path(__file__).resolve().parents[1] / "metadata"
+
+
+def merge_names_loop(gen, df):
+    """The per speaker loop used by merge_names_information before the join
+
+    Series.items replaces Series.iteritems. Newer pandas does not upcast a
+    column on assignment, the columns are filled as objects and their types
+    inferred at the end, as the older pandas did on every assignment.
+    """
+    for column, default in (("function", ""), ("birthyear", 0), ("age", 0),
+                            ("sex", ""), ("titles", ""), ("party", "")):
+        df[column] = pd.Series(default, index=df.index, dtype=object)
+    df["name"] = df["name"].astype(object)
+
+    grp = df.groupby('steno_name')
+    for nidx, steno_name in gen.names.steno_name.items():
+        try:
+            idx = grp.groups[steno_name.lower()]
+            df.loc[idx, "function"] = gen.names.loc[nidx, "function"]
+            df.loc[idx,"birthyear"] = gen.names.loc[nidx,"birthdate"].year
+            df.loc[idx,"age"] = gen.names.loc[nidx,"age"]
+            df.loc[idx,"sex"] = gen.names.loc[nidx,"sex"]
+            df.loc[idx,"name"] = gen.names.loc[nidx,"name"]
+            df.loc[idx,"titles"] = gen.names.loc[nidx,"titles"]
+            df.loc[idx,"party"] = gen.names.loc[nidx,"party"]
+        except KeyError:
+            pass
+    df = df.infer_objects()
+
+    column_names = ['session', 'date', 'topic_idx', 'topic_str', 'order', 'name',
+                    'steno_name', 'function', 'file_name', 'tokens', 'birthyear', 'age', 'sex',
+                    'titles', 'party', 'text']
+    return df[column_names]
+
+
+def measure(merge, gen, repeat):
+    """Returns the result of merge on a copy of the summary and the best time in seconds"""
+    times = []
+    for _ in range(repeat):
+        df = gen.df.copy()
+        start = time.perf_counter()
+        result = merge(df)
+        times.append(time.perf_counter() - start)
+    return (result, min(times))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare the speakers merge with the old per speaker loop')
+    parser.add_argument('-s', '--summary', action='store',
+                        default=METADATA_DIRECTORY / "file_summary_1993.tvs",
+                        dest='summary', help='file_summary.tsv of a period')
+    parser.add_argument('-n', '--speakers', action='store',
+                        default=METADATA_DIRECTORY / "speakers_summary_1993.tsv",
+                        dest='speakers', help='speakers_summary.tsv of the same period')
+    parser.add_argument('-r', '--repeat', action='store', default=3, type=int,
+                        dest='repeat', help='number of runs of each version, the best time is printed')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    gen = GeneratePandasDataFrame(Path("."), Path("."))
+    gen.df = pd.read_csv(args.summary, sep='\t', header=0)
+    gen.names = pd.read_csv(args.speakers, sep='\t', header=0)
+    gen.prepare_metadata()
+    gen.df["text"] = ""
+    gen.df["tokens"] = 0
+
+    (old, old_time) = measure(lambda df: merge_names_loop(gen, df), gen, args.repeat)
+    (new, new_time) = measure(gen.merge_names_information, gen, args.repeat)
+
+    print(f"{len(gen.df)} interventions, {len(gen.names)} speakers")
+    print("{:>6}: {:8.3f}s".format("loop", old_time))
+    print("{:>6}: {:8.3f}s".format("join", new_time))
+
+    try:
+        pd.testing.assert_frame_equal(old, new)
+    except AssertionError as error:
+        print(f"DIFFERENT data frames:\n{error}")
+        sys.exit(1)
+    print("Data frames are equal")
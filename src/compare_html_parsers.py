@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: compare_html_parsers
+
+   :synopsis: Parses the cached steno and topic pages with every HTML parser
+              and reports the pages where the interventions differ. Used to
+              verify that a faster parser produces the same output.
+
+.. moduleauthor:: Manuel Berrocal <mbercas@gmail.com>
+
+"""
+"""
+GNU General Public License v3.0
+Permissions of this strong copyleft license are conditioned on making available complete source code of licensed works and modifications, which include larger works using a licensed work, under the same license. Copyright and license notices must be preserved. Contributors provide an express grant of patent rights.
+"""
+
+import argparse
+import re
+import sys
+import time
+
+from pathlib import Path
+
+from download_stenos import SessionParser, HTML_PARSERS, STENO_STRAINER, TOPIC_STRAINER
+from page_cache import DirectoryCache
+
+
+def session_parsers(year, parsers, cache_directory):
+    """Returns one SessionParser per HTML parser, they are reused for all the pages
+
+    :param year int: session year of the pages
+    :param parsers list: names of the HTML parsers
+    :param cache_directory pathlib.Path: cache directory, pages are not requested
+    :rtype dict: the session parsers indexed by HTML parser
+    """
+    cache = DirectoryCache(cache_directory)
+    return {parser: SessionParser(year, "", "0", "", cache=cache, html_parser=parser)
+            for parser in parsers}
+
+
+def parse_steno_page(session, text):
+    """Returns the interventions and speakers found in a steno page"""
+    session.speakers = {}
+    interventions = session.parse_steno(session.make_soup(text, STENO_STRAINER))
+    return (interventions, session.speakers)
+
+
+def parse_topic_page(session, text):
+    """Returns the date and the interventions info found in a topic page"""
+    session.interventions_info = {}
+    soup = session.make_soup(text, TOPIC_STRAINER)
+    (rc, date) = session.get_steno_date(soup)
+    if rc:
+        session.parse_interventions_page(soup, date)
+    return (date, session.interventions_info)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare the output of the HTML parsers on cached pages')
+    parser.add_argument('-c', '--cache-dir', action='store', default='.cache',
+                        dest='cache_directory',
+                        help='cache directory, default .cache')
+    parser.add_argument('-y', '--year', action='store', default='2017',
+                        dest='year',
+                        help='session year of the pages')
+    parser.add_argument('-p', '--parsers', action='store', default=','.join(HTML_PARSERS),
+                        dest='parsers',
+                        help='comma separated list of parsers to compare')
+
+    args = parser.parse_args()
+    if not Path(args.cache_directory).exists():
+        print(f"Error: can not find cache directory {args.cache_directory}")
+        sys.exit(-1)
+    return args
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    year = int(args.year)
+    parsers = args.parsers.split(',')
+
+    steno_regex = re.compile(r's\d+\.htm$')
+    topic_regex = re.compile(r'\.html(#.*)?$')
+
+    cache_path = Path(args.cache_directory)
+    sessions = session_parsers(year, parsers, cache_path)
+    pages = sorted(f for f in cache_path.rglob('*')
+                   if f.is_file() and f'{year}ps' in f.as_posix())
+
+    elapsed = {parser: 0.0 for parser in parsers}
+    compared = 0
+    differences = 0
+    for page in pages:
+        if steno_regex.search(page.name):
+            parse = parse_steno_page
+        elif topic_regex.search(page.name):
+            parse = parse_topic_page
+        else:
+            continue
+
+        text = page.read_text(encoding='utf-8')
+        results = []
+        for parser in parsers:
+            start = time.perf_counter()
+            results.append(parse(sessions[parser], text))
+            elapsed[parser] += time.perf_counter() - start
+
+        compared += 1
+        for parser, result in zip(parsers[1:], results[1:]):
+            if result != results[0]:
+                differences += 1
+                print(f"DIFFERENT: {page} {parsers[0]} != {parser}")
+
+    for session in sessions.values():
+        session.fetcher.close()
+
+    print(f"Compared {compared} pages, {differences} differences")
+    for parser in parsers:
+        print(f"  {parser:>10}: {elapsed[parser]:.1f}s")
+    sys.exit(0 if differences == 0 else 1)
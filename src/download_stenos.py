@@ -26,13 +26,35 @@ Permissions of this strong copyleft license are conditioned on making available
 
 import os, sys
 import re
+import json
+import time
+import hashlib
 import logging
-from bs4 import BeautifulSoup
+import multiprocessing
+from bs4 import BeautifulSoup, SoupStrainer
 import requests
 import argparse
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
 from pathlib import Path
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import repeat
+
+from fetcher import Fetcher, FetchError, TRANSPORTS
+from page_cache import open_cache
+from instrumentation import Instrumentation
 
 class SessionManager:
     __slots__ = ['valid', 'title', 'index', 'date', 'base_session_url']
@@ -55,9 +77,22 @@ CzechMonths = {'ledna':1, 'února':2, 'března':3,'dubna':4,'května':5,
                'října':10, 'listopadu':11, 'prosince':12 }
 
 
-def get_all_stenos(res, year):
+# Parsers that can be used by BeautifulSoup, html5lib is the most lenient
+# and the slowest one.
+HTML_PARSERS = ['html5lib', 'lxml']
+
+# Server of the pages of the speakers
+PSP_URL = "http://www.psp.cz/"
+
+# Parts of the pages used by the parser, with lxml only these parts of the
+# steno and topic pages are converted into a tree
+STENO_STRAINER = SoupStrainer('div', id='main-content')
+TOPIC_STRAINER = SoupStrainer(['title', 'a'])
+
+
+def get_all_stenos(res, year, html_parser='html5lib'):
     """Gets the content page of PSP and returns all the links to the prococols"""
-    soup_main = BeautifulSoup(res, 'html5lib')
+    soup_main = BeautifulSoup(res, html_parser)
     if year >= 2010:
         reg_ex_steno_main = re.compile(r'^.*schuz.*htm[l]?$')
     else:
@@ -69,15 +104,217 @@ def check_request(res):
     """Returns False if the request failed"""
     rc = True
     if res.status_code == requests.codes.ok:
-        logging.info("Connected to page %s", steno_page_url)
-        if steno_page_url == "http://psp.cz/eknih/2010ps/stenprot/index.htm":
-            print("found")
+        logging.info("Connected to page %s", res.url)
     else:
-        logging.error("Unable to open page: %s", steno_page_url)
+        logging.error("Unable to open page: %s (%s)", res.url, res.status_code)
         rc = False
     return rc
 
 
+def current_rss():
+    """Returns the resident memory of the process in MB, 0.0 if it is not known"""
+    try:
+        with open('/proc/self/statm') as fd:
+            pages = int(fd.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return 0.0
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def peak_rss():
+    """Returns the peak resident memory of the process in MB"""
+    if resource is None:
+        return 0.0
+    # ru_maxrss is in kB in Linux and in bytes in macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def page_digest(text):
+    """Returns a hash of the page contents"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class Manifest:
+    """Record of the sessions stored in an output directory
+
+    For every session the manifest keeps the hash of the session page, the
+    steno pages that were parsed and the files that were generated, so an
+    incremental run can skip the sessions that did not change.
+    """
+
+    def __init__(self, output_directory):
+        """Constructor
+        :param output_directory pathlib.Path: the output directory of the period
+        """
+        self.file_name = output_directory / "manifest.json"
+        self.sessions = {}
+        if self.file_name.exists():
+            with self.file_name.open(encoding='utf-8') as fd:
+                self.sessions = json.load(fd)["sessions"]
+        else:
+            self.read_report(output_directory)
+
+    def read_report(self, output_directory):
+        """Creates the manifest from the file_summary.tsv of a run without manifest,
+        the sessions in the report have no hash and are considered up to date"""
+        csv_file = output_directory.joinpath("file_summary.tsv")
+        if not csv_file.exists():
+            return
+
+        with csv_file.open() as fd:
+            fd.readline()
+            for line in fd:
+                fields = line.rstrip('\n').split('\t')
+                if fields[0] not in self.sessions:
+                    self.sessions[fields[0]] = {"link": "", "digest": None,
+                                                "stenos": [], "files": []}
+                self.sessions[fields[0]]["files"].append(fields[-1])
+
+    def __contains__(self, session_number):
+        return str(int(session_number)) in self.sessions
+
+    def is_up_to_date(self, session_number, digest):
+        """Returns True if the session was stored from the same session page
+        and all its pages were downloaded"""
+        key = str(int(session_number))
+        if key not in self.sessions or len(self.sessions[key].get("failed", [])) > 0:
+            return False
+        return self.sessions[key]["digest"] in (None, digest)
+
+    def partial_sessions(self, output_directory):
+        """Returns the sessions in file_summary.tsv that are not in the manifest,
+        they were being written when a previous run stopped"""
+        csv_file = output_directory.joinpath("file_summary.tsv")
+        if not csv_file.exists():
+            return []
+
+        with csv_file.open() as fd:
+            fd.readline()
+            sessions = {line.split('\t', 1)[0] for line in fd}
+        return sorted(s for s in sessions if s not in self.sessions)
+
+    def files(self, session_number):
+        """Returns the files generated for the session"""
+        return self.sessions.get(str(int(session_number)), {}).get("files", [])
+
+    def add(self, session, files):
+        """Record a session
+        :param session SessionParser: the parsed session
+        :param files list: the names of the files generated for the session
+        """
+        self.sessions[str(session.session_number)] = {"link": session.session_link,
+                                                      "digest": session.session_digest,
+                                                      "stenos": sorted(session.stenos.keys()),
+                                                      "files": files,
+                                                      "failed": session.failed_links}
+
+    def save(self):
+        tmp_file_name = self.file_name.with_suffix('.tmp')
+        with tmp_file_name.open('w', encoding='utf-8') as fd:
+            json.dump({"sessions": self.sessions}, fd, indent=1)
+        tmp_file_name.replace(self.file_name)
+
+
+# Formats of the interventions, txt creates one file per intervention, parquet
+# and arrow create one table per session in the interventions directory
+OUTPUT_FORMATS = ['txt', 'parquet', 'arrow']
+INTERVENTIONS_DIRECTORY = "interventions"
+
+
+def write_interventions_table(output_directory, session_number, rows, output_format):
+    """Writes the interventions of a session as a table with the columns of
+    file_summary.tsv and the text of the intervention
+
+    :param output_directory pathlib.Path: the output directory of the period
+    :param session_number int: the session number
+    :param rows list: tuples with the values of the columns
+    :param output_format str: parquet or arrow
+    :rtype str: name of the table file relative to the output directory
+    """
+    columns = list(zip(*rows))
+    table = pa.table({'session': pa.array(columns[0], pa.int32()),
+                      'date': pa.array(columns[1], pa.string()),
+                      'topic_idx': pa.array(columns[2], pa.int32()),
+                      'topic_str': pa.array(columns[3], pa.string()),
+                      'order': pa.array(columns[4], pa.int32()),
+                      'name': pa.array(columns[5], pa.string()),
+                      'steno_name': pa.array(columns[6], pa.string()),
+                      'file_name': pa.array(columns[7], pa.string()),
+                      'text': pa.array(columns[8], pa.string())})
+
+    directory = output_directory / INTERVENTIONS_DIRECTORY
+    directory.mkdir(parents=True, exist_ok=True)
+    if output_format == 'parquet':
+        table_file = directory / f"s_{session_number:03d}.parquet"
+        pa.parquet.write_table(table, str(table_file), compression='zstd')
+    else:
+        table_file = directory / f"s_{session_number:03d}.arrow"
+        pa.feather.write_feather(table, str(table_file), compression='zstd')
+    return table_file.relative_to(output_directory).as_posix()
+
+
+def remove_session_from_report(output_directory, session_number, files):
+    """Removes the rows and files of a session from the output directory
+
+    :param output_directory pathlib.Path: the output directory of the period
+    :param session_number int: the session to remove
+    :param files list: the files generated for the session
+    """
+    csv_file = output_directory.joinpath("file_summary.tsv")
+    if csv_file.exists():
+        with csv_file.open() as fd:
+            lines = fd.readlines()
+        session_str = str(int(session_number))
+        with csv_file.open('w') as fd:
+            fd.writelines([lines[0]] + [l for l in lines[1:] if l.split('\t', 1)[0] != session_str])
+
+    for file_name in files:
+        output_directory.joinpath(file_name).unlink(missing_ok=True)
+
+
+def sort_report(output_directory):
+    """Sorts the rows of file_summary.tsv by session, the sessions parsed again
+    in an incremental run are appended at the end of the report
+
+    :param output_directory pathlib.Path: the output directory of the period
+    """
+    csv_file = output_directory.joinpath("file_summary.tsv")
+    if not csv_file.exists():
+        return
+
+    with csv_file.open() as fd:
+        lines = fd.readlines()
+    # The sort is stable, the rows of a session keep their order
+    rows = sorted(lines[1:], key=lambda l: int(l.split('\t', 1)[0]))
+    tmp_file = csv_file.with_suffix('.tmp')
+    with tmp_file.open('w') as fd:
+        fd.writelines(lines[:1] + rows)
+    tmp_file.replace(csv_file)
+
+
+def read_speakers_report(output_directory):
+    """Reads the speakers of a previous run from speakers_summary.tsv
+
+    :param output_directory pathlib.Path: the output directory of the period
+    :rtype dict: the speakers indexed by speaker key
+    """
+    speakers = {}
+    csv_file = output_directory.joinpath("speakers_summary.tsv")
+    if not csv_file.exists():
+        return speakers
+
+    with csv_file.open() as fd:
+        fd.readline()
+        for line in fd:
+            (name, titles, function, steno_name, sex,
+             group, birthdate, key) = line.rstrip('\n').split('\t')
+            speakers[key] = Speaker(stenoname=steno_name, pagename="", name=name,
+                                    titles=titles, function=function, sex=sex,
+                                    group=group, birthdate=birthdate, link="")
+    return speakers
+
+
 # Define some data types for collections of the data
 InterventionInfo = namedtuple('InterventionInfo', ['pageref', 'stenopage', 'reftag', 'steno_name', 'date'])
 Intervention = namedtuple('Intervention', ['stenoname', 'text', 'speaker_key'])
@@ -85,18 +322,154 @@ Speaker = namedtuple('Speaker', ['stenoname', 'pagename', 'name', 'titles', 'fun
                                  'sex', 'group', 'birthdate', 'link'])
 
 
+def filter_text(text):
+    """Removes the leading : and normalizes the white spaces of the text"""
+
+    if len(text) == 0:
+        return ""
+
+    # remove : at beginning of paragraph
+    if text[0] == ':':
+        text = text[1:].strip()
+
+    # replace '\xa0' with space
+    text = text.replace('\xa0', ' ')
+
+    # replace multiple spaces with one, and remove white spaces
+    # from beginning and end
+    text = re.sub( '\s+', ' ', text).strip()
+
+    return text
+
+
+def parse_steno_soup(steno):
+    """Parse the steno text and generate a interventions dictionary
+    The interventions is a dictionary containing the topic id (r<nn>)
+    as a key and tupple with the speker and text for the intervention.
+
+    Returns the interventions and a dictionary with the speakers found in
+    the page, in the order they appear.
+    """
+    r_id = ""
+    text = ""
+    speaker = ""
+    interventions = {}
+    speakers = {}
+
+    # remove the parts of the page that do not contain information
+    #soup.head.decompose()
+    #soup.find('div', id='header').decompose()
+    #soup.find('div', id='menu').decompose()
+    #soup.find('div', id='tools').decompose()
+    #soup.find('div', id='footer').decompose()
+
+    #[s.decompose() for s in soup.find_all('script')]
+
+
+    steno = steno.find("div", id='main-content')
+    [div.decompose() for div in steno.find_all("div")]
+
+    #remove all centered paragraphs - they contain headers
+    [p.decompose() for p in steno.find_all('p', attrs={'align':'center'})]
+    [p.decompose() for p in steno.find_all('center')]
+
+    # aligned paragraphs do only exist after 1996
+    #text_paragraphs = steno.find_all('p', attrs={'align':'justify'})
+    text_paragraphs = steno.find_all('p')
+
+    # print(f">> {len(text_paragraphs)=}")
+
+    speaker_key = ""
+    for p in text_paragraphs:
+        # ignore empty
+        if p.text == '\xa0' or p.text == '':
+            continue
+        
+        speaker_link = p.find('a')
+
+        # print(f" >> >> >> {speaker_link=}")
+        #if speaker_link and speaker_link.has_attr('id') and speaker_link.has_attr('href') and 'hlasy.sqw' not in speaker_link['href']:
+        if speaker_link and speaker_link.has_attr('id'):
+            if speaker_link.has_attr('href'):
+                if 'hlasy.sqw' in speaker_link['href']: #or "historie.sqw" in speaker_link['href']:
+                    #text += filter_text(speaker_linkp.text)
+                    continue
+            if speaker_link.text == "":
+                continue
+
+            if r_id != "":
+                interventions[r_id] = Intervention(stenoname=speaker, text=text.strip(), speaker_key=speaker_key)
+            text = ""
+            #if speaker_link.has_attr('id') and 'hlasy.sqw' not in speaker_link['href']:
+            if speaker_link.has_attr('id'):
+                r_id = speaker_link['id']
+
+                # some names have a : at the end - remove
+                speaker_link_text = filter_text(speaker_link.text)
+
+                # old stenos have no href use steno name as key instead
+
+                if speaker_link_text[-1] == ":":
+                    speaker_link_text = speaker_link_text[:-1]
+
+                speaker = speaker_link_text.strip().replace(' ', '_')
+                speaker = speaker.replace(',', '_').replace('__', '_')
+
+                speaker_key = speaker
+                try:
+                    speaker_page = speaker_link['href']
+                except:
+                    speaker_page = ""                  
+
+                if speaker_key not in speakers:
+                    speakers[speaker_key] = Speaker(speaker_link_text, "", "", "", "", "", "", "", speaker_page)
+
+            speaker_link.extract()
+
+        text += filter_text(p.text.strip()) + "\n"
+    if r_id != "":
+        interventions[r_id] = Intervention(stenoname=speaker, text=text.strip(), speaker_key=speaker_key)
+    return (interventions, speakers)
+
+
+def parse_steno_page(text, html_parser='html5lib'):
+    """Parses a steno page, runs in the worker processes of the parse stage
+
+    :param text str: the contents of the steno page
+    :param html_parser str: one of HTML_PARSERS
+    :rtype tuple: the interventions and the speakers found in the page, and
+                  the seconds spent parsing the HTML and extracting the interventions
+    """
+    start = time.perf_counter()
+    if html_parser == 'html5lib':
+        soup = BeautifulSoup(text, html_parser)
+    else:
+        soup = BeautifulSoup(text, html_parser, parse_only=STENO_STRAINER)
+    parsed = time.perf_counter()
+    (interventions, speakers) = parse_steno_soup(soup)
+    return (interventions, speakers, (parsed - start, time.perf_counter() - parsed))
+
+
 class SessionParser:
 
     class Page:
+        """Record of a topic page, keeps the date of the page, the contents
+        and the tree are only kept for debugging"""
+        __slots__ = ['link', 'date_string', 'content', 'soup']
         def __init__(self):
             self.link = ""
             self.date_string = ""
             self.content = ""
             self.soup = None
 
-    def __init__(self, year, base_url, session_number, session_link):
+    def __init__(self, year, base_url, session_number, session_link, fetcher=None, cache=None,
+                 html_parser='html5lib', parse_pool=None, keep_trees=False, stats=None):
 
         self.year = year
+        self.stats = stats if stats is not None else Instrumentation()
+        self.keep_trees = keep_trees
+        self.html_parser = html_parser
+        self.parse_pool = parse_pool
         self.base_url = base_url
         self.sublinks = base_url + session_number + "schuz/"
         self.session_link = base_url + session_link
@@ -108,43 +481,99 @@ class SessionParser:
         self.topic_titles = {}
         self.interventions_info = {}
         self.speakers = {}
+        self.session_digest = ""
+        self.failed_links = []
         self.request_counter = 0
         self.visited_links = {}
+        self.prefetched = []
+        self.site_url = PSP_URL
 
-        self.cache = Path('.') / '.cache'
-        if not self.cache.exists():
-            self.cache.mkdir(parents=True)
+        self.fetcher = fetcher if fetcher is not None else Fetcher()
 
+        self.cache = cache if cache is not None else open_cache()
 
-    def request(self, link):
-        """Manages the request to the link and collect statistis
+    def make_soup(self, text, parse_only=None):
+        """Parses the page with the selected parser
 
-        Before making a connection checks if the file can be retrieved
-        from cache.
+        html5lib always builds the tree of the whole page, with lxml only
+        the tags selected by parse_only are kept.
 
-        :param link str: link to the page to request
-        :rtype str: the contents of the web page in a string"""
+        :param text str: the contents of the page
+        :param parse_only SoupStrainer: the parts of the page to parse
+        :rtype BeautifulSoup: the parsed page
+        """
+        with self.stats.timer('html_parse'):
+            if self.html_parser == 'html5lib' or parse_only is None:
+                return BeautifulSoup(text, self.html_parser)
+            return BeautifulSoup(text, self.html_parser, parse_only=parse_only)
 
-        file_str = link.replace('http://public.psp.cz/eknih/', '')
+    def prefetch(self, links):
+        """Schedule the download of the links that are not in the cache, the
+        downloads that are not requested are discarded by `release_prefetched`
 
-        cached_file_name = self.cache / file_str
-        text = ""
+        :param links list: links to the pages that will be requested later
+        """
+        links = [link for link in links if link not in self.cache]
+        self.prefetched.extend(links)
+        self.fetcher.prefetch(links)
+
+    def release_prefetched(self):
+        """Discards the scheduled downloads that were not requested, called
+        when the session is complete"""
+        discarded = self.fetcher.discard(self.prefetched)
+        if discarded > 0:
+            logging.debug(f"Discarded {discarded} prefetched pages of session {self.session_number}")
+        self.prefetched = []
+
+    def request(self, link, revalidate=False):
+        """Manages the request to the link and collect statistis
 
+        Before making a connection checks if the file can be retrieved
+        from cache. Stale pages in the cache are revalidated with their
+        ETag and Last-Modified headers.
 
-        if cached_file_name.exists():
-            logging.debug(f"{cached_file_name} ...reusing")
-            text = cached_file_name.read_text(encoding='utf-8')
-        else:
-            res = requests.get(link)
+        :param link str: link to the page to request
+        :param revalidate bool: revalidate the cached page even if it is not stale
+        :rtype str: the contents of the web page in a string"""
 
-            self.request_counter += 1
-            if False == check_request(res):
-                raise Exception()
+        with self.stats.timer('cache'):
+            cached = self.cache.get(link)
+        if cached is not None and not revalidate and not self.cache.is_stale(cached):
+            logging.debug(f"{link} ...reusing")
+            self.stats.count('cache_hits')
+            return cached.text
+        self.stats.count('cache_misses')
+
+        headers = {}
+        if cached is not None:
+            if cached.etag is not None:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified is not None:
+                headers['If-Modified-Since'] = cached.last_modified
 
-            cached_file_name.parents[0].mkdir(parents=True, exist_ok=True)
-            cached_file_name.write_text(res.text, encoding='utf-8')
-            text = res.text
-        return text
+        try:
+            with self.stats.timer('fetch'):
+                res = self.fetcher.get(link, headers)
+        except FetchError:
+            self.failed_links.append(link)
+            raise
+
+        self.request_counter += 1
+        self.stats.count('requests')
+        self.stats.count('bytes_downloaded', res.size)
+        if cached is not None and res.status_code == requests.codes.not_modified:
+            logging.debug(f"{link} ...not modified")
+            self.cache.touch(link)
+            return cached.text
+
+        if False == check_request(res):
+            self.fetcher.add_dead_letter(link, f"HTTP {res.status_code}")
+            self.failed_links.append(link)
+            raise FetchError(f"{link}: HTTP {res.status_code}")
+
+        with self.stats.timer('cache'):
+            self.cache.put(link, res.text, res.headers)
+        return res.text
 
 
     def parse_session_post_2013(self):
@@ -287,12 +716,15 @@ class SessionParser:
 
         try:
             text = self.request(self.session_link)
-        except Exception:
+        except FetchError:
             return False
 
-        main_soup =  BeautifulSoup(text, 'html5lib')
+        self.session_digest = page_digest(text)
+        main_soup =  self.make_soup(text)
         self.session_soup = main_soup
 
+        self.prefetch_topic_pages()
+
         if self.year == 2013:
             self.parse_session_2013()
         elif self.year > 2013:
@@ -300,119 +732,103 @@ class SessionParser:
         else:
             self.parse_session_pre_2013()
 
+        if not self.keep_trees:
+            self.session_soup = None
+
         # All links to interventions are now in self.interventions
         # first download all individual pages into stenos dictionary
         #
         self.get_all_stenos()
 
+    def prefetch_topic_pages(self):
+        """Schedule the download of all the topic pages linked from the session page"""
+        if self.year >= 2013:
+            reg_ex_topic = re.compile(r'^.*html#(q[\d]+)$')
+        else:
+            reg_ex_topic = re.compile(r'^.*html#([\d]+)$')
+
+        # the topic page is requested later with the fragment of one of its
+        # links, the fetcher ignores the fragments and the page is not
+        # prefetched if it is in the cache with any of them
+        links = {}
+        for link in self.session_soup.find_all('a', href=True):
+            sublink = link['href']
+            if "/sqw/historie.sqw" in sublink or None == reg_ex_topic.match(sublink):
+                continue
+            topic_page = self.get_topic_page(sublink)
+            if topic_page is not None:
+                links.setdefault(topic_page[0], []).append(topic_page[1])
+        self.prefetch([page_links[0] for page_links in links.values()
+                       if not any(link in self.cache for link in page_links)])
+
+    def get_session_digest(self):
+        """Returns the hash of the session page or None if it can not be downloaded
+
+        The cached session page is always revalidated with the server, a
+        cached copy would hide the changes to the session."""
+        try:
+            return page_digest(self.request(self.session_link, revalidate=True))
+        except FetchError:
+            return None
+
     def get_all_stenos(self):
         """Iterate the interventions dictionary to download all the pages of
-        the stenos, parse them and strore them in the stenos dictionary"""
+        the stenos, parse them and strore them in the stenos dictionary
+
+        The pages are first downloaded and then parsed, in the process pool
+        if there is one. The results are collected in the order of the pages
+        so the speakers are found in the same order as in a sequential run."""
+        self.prefetch([self.sublinks + int_info.stenopage
+                       for topic in self.topics.values()
+                       for int_info in topic
+                       if int_info.stenopage not in self.stenos])
+
+        # fetch stage
+        texts = {}
         for topic in self.topics.values():
             if len(topic) == 0:
                 continue
 
             for int_info in topic:
-                if int_info.stenopage not in self.stenos:
+                if int_info.stenopage not in self.stenos and int_info.stenopage not in texts:
                     link = self.sublinks + int_info.stenopage
 
                     try:
-                        text = self.request(link)
-                    except Exception:
+                        texts[int_info.stenopage] = self.request(link)
+                    except FetchError:
                         logging.error("Can not open steno page %s", link)
                         continue
 
-                    # All paragraphs with text are justified
-                    text = text #.lower()
-                    soup =  BeautifulSoup(text, 'html5lib')
-                    self.stenos[int_info.stenopage] = self.parse_steno(soup)
-
-    def parse_steno(self, steno):
-        """Parse the steno text and generate a interventions dictionary
-        The interventions is a dictionary containing the topic id (r<nn>)
-        as a key and tupple with the speker and text for the intervention.
-        """
-        r_id = ""
-        text = ""
-        speaker = ""
-        interventions = {}
-
-        # remove the parts of the page that do not contain information
-        #soup.head.decompose()
-        #soup.find('div', id='header').decompose()
-        #soup.find('div', id='menu').decompose()
-        #soup.find('div', id='tools').decompose()
-        #soup.find('div', id='footer').decompose()
-
-        #[s.decompose() for s in soup.find_all('script')]
-
-
-        steno = steno.find("div", id='main-content')
-        [div.decompose() for div in steno.find_all("div")]
-
-        #remove all centered paragraphs - they contain headers
-        [p.decompose() for p in steno.find_all('p', attrs={'align':'center'})]
-        [p.decompose() for p in steno.find_all('center')]
-
-        # aligned paragraphs do only exist after 1996
-        #text_paragraphs = steno.find_all('p', attrs={'align':'justify'})
-        text_paragraphs = steno.find_all('p')
-
-        # print(f">> {len(text_paragraphs)=}")
-
-        speaker_key = ""
-        for p in text_paragraphs:
-            # ignore empty
-            if p.text == '\xa0' or p.text == '':
-                continue
-            
-            speaker_link = p.find('a')
-
-            # print(f" >> >> >> {speaker_link=}")
-            #if speaker_link and speaker_link.has_attr('id') and speaker_link.has_attr('href') and 'hlasy.sqw' not in speaker_link['href']:
-            if speaker_link and speaker_link.has_attr('id'):
-                if speaker_link.has_attr('href'):
-                    if 'hlasy.sqw' in speaker_link['href']: #or "historie.sqw" in speaker_link['href']:
-                        #text += self.filter_text(speaker_linkp.text)
-                        continue
-                if speaker_link.text == "":
-                    continue
-
-                if r_id != "":
-                    interventions[r_id] = Intervention(stenoname=speaker, text=text.strip(), speaker_key=speaker_key)
-                text = ""
-                #if speaker_link.has_attr('id') and 'hlasy.sqw' not in speaker_link['href']:
-                if speaker_link.has_attr('id'):
-                    r_id = speaker_link['id']
-
-                    # some names have a : at the end - remove
-                    speaker_link_text = self.filter_text(speaker_link.text)
-
-                    # old stenos have no href use steno name as key instead
-
-                    if speaker_link_text[-1] == ":":
-                        speaker_link_text = speaker_link_text[:-1]
-
-                    speaker = speaker_link_text.strip().replace(' ', '_')
-                    speaker = speaker.replace(',', '_').replace('__', '_')
-
-                    speaker_key = speaker
-                    try:
-                        speaker_page = speaker_link['href']
-                    except:
-                        speaker_page = ""                  
-
-                    if speaker_key not in self.speakers:
-                        logging.info("New speaker found: %s", speaker_link_text)
-                        self.speakers[speaker_key] = Speaker(speaker_link_text, "", "", "", "", "", "", "", speaker_page)
+        # parse stage
+        if self.parse_pool is None:
+            results = map(parse_steno_page, texts.values(), repeat(self.html_parser))
+        else:
+            results = self.parse_pool.map(parse_steno_page, texts.values(), repeat(self.html_parser),
+                                          chunksize=4)
 
-                speaker_link.extract()
+        for stenopage, (interventions, speakers, timings) in zip(texts.keys(), results):
+            self.stenos[stenopage] = interventions
+            self.add_speakers(speakers)
+            self.stats.add_time('html_parse', timings[0])
+            self.stats.add_time('extraction', timings[1])
+            self.stats.count('steno_pages')
 
-            text += self.filter_text(p.text.strip()) + "\n"
-        if r_id != "":
-            interventions[r_id] = Intervention(stenoname=speaker, text=text.strip(), speaker_key=speaker_key)
+    def parse_steno(self, steno):
+        """Parse the steno text and generate a interventions dictionary,
+        the new speakers found in the steno are added to the speakers"""
+        (interventions, speakers) = parse_steno_soup(steno)
+        self.add_speakers(speakers)
         return interventions
 
+    def add_speakers(self, speakers):
+        """Adds the speakers that are not yet known
+        :param speakers dict: speakers found in a steno page, in page order
+        """
+        for speaker_key, speaker in speakers.items():
+            if speaker_key not in self.speakers:
+                logging.info("New speaker found: %s", speaker.stenoname)
+                self.speakers[speaker_key] = speaker
+
 
     def parse_speakers(self):
 
@@ -432,25 +848,25 @@ class SessionParser:
             if "https://www.vlada.cz/cz/" in speaker.link:
                 try:
                     text = self.request(speaker.link)
-                except Exception:
+                except FetchError:
                     logging.error("Failed retrieving info for {}", speaker.stenoname)
                     sys.exit(-1)
-                soup = BeautifulSoup(text, 'html5lib')
+                soup = self.make_soup(text)
                 page_name = self.filter_text(soup.find('h1').text)
             elif "/sqw/detail.sqw" in speaker.link:
                 idx = regex.search(speaker.link)
                 if idx:
 
-                    link = "http://www.psp.cz/" + speaker.link
+                    link = self.site_url + speaker.link
 
 
                     try:
                         text = self.request(link)
-                    except Exception:
+                    except FetchError:
                         logging.error("Failed retrieving info for {}", speaker.values().stenoname)
                         sys.exit(-1)
 
-                    soup = BeautifulSoup(text, 'html5lib')
+                    soup = self.make_soup(text)
 
                     page_name = self.filter_text(soup.find('h1').text)
 
@@ -523,26 +939,18 @@ class SessionParser:
         return (name, titles, function, sex)
 
     def filter_text(self, text):
+        return filter_text(text)
 
-        if len(text) == 0:
-            return ""
-
-        # remove : at beginning of paragraph
-        if text[0] == ':':
-            text = text[1:].strip()
-
-        # replace '\xa0' with space
-        text = text.replace('\xa0', ' ')
-
-        # replace multiple spaces with one, and remove white spaces
-        # from beginning and end
-        text = re.sub( '\s+', ' ', text).strip()
+    def generate_files_and_report(self, output_directory=Path('.'), create_new_report=True,
+                                  output_format='txt'):
+        """Iterate the topics dictionary to get all the intrventions per
+        topic, then go to the stenos dictionary to print get intervention
 
-        return text
+        With the txt format every intervention is written to its own file,
+        with the parquet and arrow formats the interventions of the session
+        are written to one table. The report is written in every format.
 
-    def generate_files_and_report(self, output_directory=Path('.'), create_new_report=True):
-        """Iterate the topics dictionary to get all the intrventions per
-        topic, then go to the stenos dictionary to print get intervention"""
+        :rtype list: the names of the generated files"""
         if not output_directory.exists():
             output_directory.mkdir(parents=True)
 
@@ -557,6 +965,8 @@ class SessionParser:
             open_str = 'a+'
 
         count = 0
+        files = []
+        rows = []
         with csv_file.open(open_str) as report_fd:
             tsv_line = "session\tdate\ttopic_idx\ttopic_str\torder\tname\tsteno_name\tfile_name\n"
 
@@ -585,20 +995,24 @@ class SessionParser:
                                                             steno.stenoname)
                         full_file_name = output_directory.joinpath(file_name)
 
-                        with full_file_name.open('w', encoding = 'utf-8') as fd:
-                            fd.write(steno.text)
-
-                            tsv_line = "{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(
-                                self.session_number,
-                                int_info.date,
-                                topic_id,
-                                self.topic_titles[topic_id],
-                                idx+1,
-                                self.speakers[steno.speaker_key].name,
-                                steno.stenoname,
-                                file_name)
-                            report_fd.write(tsv_line)
+                        fields = (self.session_number,
+                                  int_info.date,
+                                  topic_id,
+                                  self.topic_titles[topic_id],
+                                  idx+1,
+                                  self.speakers[steno.speaker_key].name,
+                                  steno.stenoname,
+                                  file_name)
+
+                        if output_format == 'txt':
+                            with full_file_name.open('w', encoding = 'utf-8') as fd:
+                                fd.write(steno.text)
+                            files.append(file_name)
+                        else:
+                            rows.append(fields + (steno.text,))
 
+                        tsv_line = "{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(*fields)
+                        report_fd.write(tsv_line)
 
                         count += 1
                     except KeyError:
@@ -606,7 +1020,12 @@ class SessionParser:
 
                         #logging.error("Can not find key %s in steno %s",
                         #              int_info.reftag, int_info.stenopage)
+        if len(rows) > 0:
+            files.append(write_interventions_table(output_directory, self.session_number,
+                                                   rows, output_format))
+
         logging.info(f"GENERATE FILES: {count} files generated")
+        return files
 
 
     def generate_speakers_report(self, output_directory, speakers, create_new_report):
@@ -658,8 +1077,12 @@ class SessionParser:
         return file_name
 
 
-    def parse_sublink_order(self, order_id, sublink):
+    def get_topic_page(self, sublink):
+        """Returns the page index and the link of the topic page in the sublink
 
+        :param sublink str: link to the topic as found in the session page
+        :rtype tuple: (page_idx, link) or None if the sublink is not valid
+        """
         if self.year >= 2010:
             reg_ex_page = re.compile('^(.*.html).*')
         else:
@@ -668,35 +1091,45 @@ class SessionParser:
         page_name = reg_ex_page.match(sublink)
 
         if None == page_name:
-            logging.error("Can not find page name in sublink %s", sublink)
-            return False
+            return None
 
+        page_idx = page_name.group(1)
         if self.year >= 2010:
-            page_idx = page_name.group(1)
+            link = self.sublinks + sublink
         else:
-            page_idx = page_name.group(1) #sublink
+            link = self.sublinks + page_name.group(1)
+        return (page_idx, link)
 
-        if page_idx not in self.pages:
-            if self.year >= 2010:
-                link = self.sublinks + sublink
-            else:
-                link = self.sublinks + page_name.group(1)
+    def parse_sublink_order(self, order_id, sublink):
+
+        topic_page = self.get_topic_page(sublink)
 
+        if None == topic_page:
+            logging.error("Can not find page name in sublink %s", sublink)
+            return False
+
+        (page_idx, link) = topic_page
+
+        if page_idx not in self.pages:
             try:
                 text = self.request(link)
-            except Exception:
+            except FetchError:
                 return False
 
             page = self.Page()
             page.link = link
-            page.content = text
-            page.soup = BeautifulSoup(text, 'html5lib')
-            (rc, date) = self.get_steno_date(page.soup)
+            soup = self.make_soup(text, TOPIC_STRAINER)
+            (rc, date) = self.get_steno_date(soup)
             if False == rc:
                 logging.error("Can not find date in steno %s", link)
                 return False
             page.date_string = date
-            self.parse_interventions_page(page.soup, date)
+            with self.stats.timer('extraction'):
+                self.parse_interventions_page(soup, date)
+            self.stats.count('topic_pages')
+            if self.keep_trees:
+                page.content = text
+                page.soup = soup
             self.pages[page_idx] = page
 
         return True
@@ -750,7 +1183,7 @@ class SessionParser:
         for all the links get the page if not allready in
         stenos and extract the text for a given person
         """
-        if year == 2013:
+        if self.year == 2013:
             reg_ex_topic = re.compile('^.*html(#[a-z][\d]+)$')
         else:
             reg_ex_topic = re.compile('^.*html#([\d]+)$')
@@ -821,6 +1254,68 @@ def parse_args():
                         dest='create_new_report',
                         help='creates a new report for data dowdloaded if already '
                             + 'exists, otherwise creates a new one')
+    parser.add_argument('-i', '--incremental', action='store_true', default=False,
+                        dest='incremental',
+                        help='only parse the sessions that are new or changed since '
+                            + 'the last run and append them to the report')
+    parser.add_argument('-w', '--workers', action='store', default=1, type=int,
+                        dest='workers',
+                        help='number of sessions and pages downloaded concurrently, default 1')
+    parser.add_argument('--host-connections', action='store', default=4, type=int,
+                        dest='host_connections',
+                        help='maximum number of simultaneous connections to a host, default 4')
+    parser.add_argument('-t', '--transport', action='store', default='requests',
+                        choices=sorted(TRANSPORTS.keys()),
+                        dest='transport',
+                        help='engine used to download the pages, default requests')
+    parser.add_argument('-r', '--rate', action='store', default=10.0, type=float,
+                        dest='rate',
+                        help='maximum number of requests per second, default 10')
+    parser.add_argument('--retries', action='store', default=3, type=int,
+                        dest='retries',
+                        help='retries of requests that time out or fail with a server error, default 3')
+    parser.add_argument('--timeout', action='store', default=60.0, type=float,
+                        dest='timeout',
+                        help='seconds to wait for the server, default 60')
+    parser.add_argument('-c', '--cache', action='store', default='directory',
+                        choices=['directory', 'sqlite'],
+                        dest='cache',
+                        help='page cache backend, default directory')
+    parser.add_argument('--cache-path', action='store', default=None,
+                        dest='cache_path',
+                        help='path to the cache, default .cache or pages.sqlite')
+    parser.add_argument('--cache-codec', action='store', default='xz',
+                        choices=['xz', 'zstd'],
+                        dest='cache_codec',
+                        help='compression of the pages in the sqlite cache, default xz')
+    parser.add_argument('--revalidate-after', action='store', default=None, type=float,
+                        dest='revalidate_after',
+                        help='days after which cached pages are requested again')
+    parser.add_argument('-j', '--parse-jobs', action='store', default=1, type=int,
+                        dest='parse_jobs',
+                        help='number of processes parsing the steno pages, default 1')
+    parser.add_argument('-p', '--parser', action='store', default='html5lib',
+                        choices=HTML_PARSERS,
+                        dest='html_parser',
+                        help='HTML parser, lxml is faster, default html5lib')
+    parser.add_argument('--keep-trees', action='store_true', default=False,
+                        dest='keep_trees',
+                        help='debug, keep the parsed session and topic pages in memory')
+    parser.add_argument('-f', '--output-format', action='store', default='txt',
+                        choices=OUTPUT_FORMATS,
+                        dest='output_format',
+                        help='txt creates one file per intervention, parquet and arrow '
+                            + 'one table per session, default txt')
+    parser.add_argument('--progress', action='store', default=None, type=float,
+                        dest='progress',
+                        help='print a progress line every PROGRESS seconds')
+    parser.add_argument('--stats-file', action='store', default=None,
+                        dest='stats_file',
+                        help='write the timing and counters summary to a JSON file')
+    parser.add_argument('-u', '--base-url', action='store', default=None,
+                        dest='base_url',
+                        help='alternative server to download the stenos from, i.e. '
+                            + 'a local server with a copy of the pages')
 
     args = parser.parse_args()
 
@@ -830,6 +1325,14 @@ def parse_args():
         logging.error("(): Invalid session year".format(args.year))
         sys.exit(-1)
 
+    if args.output_format != 'txt' and pa is None:
+        print(f"The {args.output_format} output format requires the pyarrow package")
+        sys.exit(-1)
+
+    if args.workers < 1 or args.host_connections < 1 or args.parse_jobs < 1:
+        print("The number of workers, host connections and parse jobs must be positive")
+        sys.exit(-1)
+
     return args
 
 
@@ -843,22 +1346,41 @@ if __name__ == "__main__":
     year = int(args.year) # 1993, 1996, 1998, 2002, 2006, 2010, 2013 or 2017
 
 
-    if int(year) >= 2010:
+    if args.base_url is not None:
+        base_page_url = f"{args.base_url.rstrip('/')}/{year}ps/stenprot/"
+    elif int(year) >= 2010:
         base_page_url = f"http://psp.cz/eknih/{year}ps/stenprot/"
     else:
         base_page_url = f"http://public.psp.cz/eknih/{year}ps/stenprot/"
     steno_page_url = base_page_url + 'index.htm'
 
-
-    res = requests.get(steno_page_url)
-
-    if check_request(res) == False:
+    stats = Instrumentation()
+    if args.progress is not None:
+        stats.start_progress(args.progress)
+
+    fetcher = Fetcher(args.workers, args.host_connections, args.transport,
+                      args.rate, args.retries, timeout=args.timeout)
+    max_age = args.revalidate_after * 24 * 3600 if args.revalidate_after is not None else None
+    cache = open_cache(args.cache, args.cache_path, args.cache_codec, max_age)
+    parse_pool = None
+    if args.parse_jobs > 1:
+        # the fetcher, progress and cache threads are already running, the
+        # workers are started with spawn so no lock is copied in a locked state
+        parse_pool = ProcessPoolExecutor(max_workers=args.parse_jobs,
+                                         mp_context=multiprocessing.get_context('spawn'))
+
+    try:
+        res = fetcher.get(steno_page_url)
+    except FetchError:
+        res = None
+
+    if res is None or check_request(res) == False:
         logging.error("Can not connect to page: {}".format(steno_page_url))
         exit(-1)
 
     # get the links for all session pages
     #
-    session_links = get_all_stenos(res.text, year)
+    session_links = get_all_stenos(res.text, year, args.html_parser)
 
     #base = set([link[:9]+"index.htm" for link in session_links])
 
@@ -869,8 +1391,8 @@ if __name__ == "__main__":
     create_new_report = args.create_new_report
     request_counter = 0
     print(f"{len(session_links)=}")
-    session = None
-    speakers = {}
+
+    sessions = []
     for idx, link in enumerate(session_links):
 
         if year < 2010:
@@ -880,25 +1402,128 @@ if __name__ == "__main__":
         if session_id == None:
             logging.debug("Can not get session number from link %s", link)
             continue
+        sessions.append((session_id.group(1), link))
 
-        session = SessionParser(year, base_page_url, session_id.group(1), link)
+    output_directory = Path(args.output_directory)
+    output_directory.mkdir(parents=True, exist_ok=True)
+    manifest = Manifest(output_directory)
+    speakers = {}
+    if create_new_report:
+        manifest.sessions = {}
+    elif args.incremental:
+        # Skip the sessions whose session page did not change, sessions
+        # that changed are removed from the report and parsed again
+        speakers = read_speakers_report(output_directory)
+        for session_number in manifest.partial_sessions(output_directory):
+            logging.info(f"Removing partially written session {session_number}")
+            remove_session_from_report(output_directory, session_number, [])
+
+        new_sessions = []
+        for (session_number, link) in sessions:
+            if session_number in manifest:
+                parser = SessionParser(year, base_page_url, session_number, link, fetcher, cache,
+                                       args.html_parser, stats=stats)
+                digest = parser.get_session_digest()
+                if digest is None:
+                    # the stored session is kept, it can not be parsed again
+                    logging.warning(f"Can not download the page of session {session_number}, "
+                                    "keeping the stored session")
+                    continue
+                if manifest.is_up_to_date(session_number, digest):
+                    logging.info(f"Skipping session {session_number}, already parsed")
+                    continue
+                remove_session_from_report(output_directory, session_number,
+                                           manifest.files(session_number))
+            new_sessions.append((session_number, link))
+        sessions = new_sessions
+        print(f"Incremental run: {len(sessions)} new or changed sessions")
+
+    def crawl_session(session_number, link, speakers):
+        session = SessionParser(year, base_page_url, session_number, link, fetcher, cache,
+                                args.html_parser, parse_pool, args.keep_trees, stats)
         session.speakers = speakers
+        if args.base_url is not None:
+            session.site_url = args.base_url.rstrip('/') + '/'
+
+        try:
+            session.parse_session()
+            session.parse_speakers()
+        finally:
+            session.release_prefetched()
+        return session
+
+    # With several workers the sessions are parsed concurrently, each one
+    # with its own speakers dictionary, and collected in the original
+    # order so the reports are the same as in a sequential run.
+    session_pool = None
+    pending = []
+    if args.workers > 1:
+        session_pool = ThreadPoolExecutor(max_workers=args.workers)
+        pending = [session_pool.submit(crawl_session, number, link, {})
+                   for (number, link) in sessions[:2 * args.workers]]
 
-        session.parse_session()
-        session.parse_speakers()
+    session = None
+    last_rss = current_rss()
+    for idx, (session_number, link) in enumerate(sessions):
+
+        if session_pool is None:
+            session = crawl_session(session_number, link, speakers)
+        else:
+            session = pending.pop(0).result()
+            if idx + len(pending) + 1 < len(sessions):
+                (number, next_link) = sessions[idx + len(pending) + 1]
+                pending.append(session_pool.submit(crawl_session, number, next_link, {}))
+
+        for key, speaker in session.speakers.items():
+            speakers.setdefault(key, speaker)
 
-        speakers = {**speakers, **session.speakers}  # requires python >=3.5
         #session.generate_files(Path(args.output_directory))
         #session.generate_report(Path(args.output_directory), create_new_report)
-        output_directory = Path(args.output_directory)
-        session.generate_files_and_report(output_directory, create_new_report)
+        with stats.timer('write'):
+            files = session.generate_files_and_report(output_directory, create_new_report,
+                                                      args.output_format)
+        manifest.add(session, files)
+        manifest.save()
 
+        stats.count('sessions')
         request_counter += session.request_counter
-        print("Completed session {}: accesses {} / cum. {}\n".format(session_id.group(1),
-                                                                     session.request_counter,
-                                                                     request_counter))
+        # with several workers other sessions are parsed at the same time,
+        # the difference is the growth since the previous session completed
+        rss = current_rss()
+        print("Completed session {}: accesses {} / cum. {} - RSS {:.0f} MB ({:+.0f} MB)\n".format(
+            session_number,
+            session.request_counter,
+            request_counter,
+            rss,
+            rss - last_rss))
+        last_rss = rss
 
         create_new_report = False
 
-    session.generate_speakers_report(Path(args.output_directory),
-                                     speakers, True)
+    if args.incremental and not args.create_new_report and len(sessions) > 0:
+        sort_report(output_directory)
+
+    if session_pool is not None:
+        session_pool.shutdown()
+    if parse_pool is not None:
+        parse_pool.shutdown()
+    fetcher.close()
+    cache.close()
+    print("Completed download: {}".format(fetcher.latency))
+    print("Peak RSS {:.0f} MB".format(peak_rss()))
+
+    dead_letter_file = output_directory / "dead_letter.tsv"
+    if len(fetcher.dead_letters) > 0:
+        print(f"Failed to download {len(fetcher.dead_letters)} pages, see {dead_letter_file}")
+        fetcher.write_dead_letters(dead_letter_file)
+    else:
+        dead_letter_file.unlink(missing_ok=True)
+
+    if session is not None:
+        with stats.timer('write'):
+            session.generate_speakers_report(output_directory, speakers, True)
+
+    stats.stop_progress()
+    print(json.dumps(stats.summary(), indent=2))
+    if args.stats_file is not None:
+        stats.write_json(args.stats_file)
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: fetcher
+
+   :synopsis: Concurrent page downloader used by download_stenos. Pages are
+              requested ahead of time through a transport so the parser
+              only waits for pages that are not yet downloaded.
+
+   Two transports are available:
+
+    - requests   a pool of threads, each one with a keep-alive requests.Session
+    - asyncio    an aiohttp client running in a background event loop
+
+.. moduleauthor:: Manuel Berrocal <mbercas@gmail.com>
+
+"""
+"""
+GNU General Public License v3.0
+Permissions of this strong copyleft license are conditioned on making available complete source code of licensed works and modifications, which include larger works using a licensed work, under the same license. Copyright and license notices must be preserved. Contributors provide an express grant of patent rights.
+"""
+
+import asyncio
+import bisect
+import logging
+import random
+import threading
+import time
+import requests
+
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from urllib.parse import urldefrag, urlsplit
+
+
+# Same attribute names as requests.Response so check_request works with both
+PageResponse = namedtuple('PageResponse', ['url', 'status_code', 'text', 'headers', 'elapsed', 'size'])
+
+
+class TransportError(Exception):
+    """Connection errors and timeouts of the transports"""
+    pass
+
+
+class FetchError(Exception):
+    """The page could not be downloaded"""
+    pass
+
+
+class TokenBucket:
+    """Rate limiter, allows `rate` requests per second with bursts of up to
+    `burst` requests"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Takes a token and returns the seconds to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+def parse_retry_after(value):
+    """Returns the seconds to wait of a Retry-After header, given in seconds or
+    as an HTTP date, or None if the header is missing or not valid"""
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def page_key(link):
+    """Returns the link without the fragment, links to the same page with
+    different fragments are one download"""
+    return urldefrag(link)[0]
+
+
+class Transport(ABC):
+    """Interface of the transports used by the Fetcher
+
+    A transport downloads pages in the background, `submit` returns a
+    `concurrent.futures.Future` that resolves to a `PageResponse`. The
+    optional headers are added to the request, i.e. for revalidation.
+    """
+
+    @abstractmethod
+    def submit(self, link, headers=None):
+        """Schedules the download of the link
+        :rtype concurrent.futures.Future: resolves to a PageResponse"""
+
+    @abstractmethod
+    def close(self):
+        """Waits for the pending downloads and releases the connections"""
+
+
+class RequestsTransport(Transport):
+    """Downloads the pages in a pool of threads, every thread keeps its own
+    requests.Session so connections to the server are reused"""
+
+    def __init__(self, workers=1, host_connections=4, rate_limiter=None, timeout=None):
+        """Constructor
+        :param workers int: number of worker threads
+        :param host_connections int: maximum number of connections per host
+        :param rate_limiter TokenBucket: limits the number of requests per second
+        :param timeout float: seconds to wait for the server
+        """
+        self.host_connections = host_connections
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def _host_semaphore(self, link):
+        host = urlsplit(link).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.host_connections)
+            return self._hosts[host]
+
+    def _session(self):
+        if not hasattr(self._local, 'session'):
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.host_connections)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+        return self._local.session
+
+    def _download(self, link, headers=None):
+        with self._host_semaphore(link):
+            if self.rate_limiter is not None:
+                time.sleep(self.rate_limiter.reserve())
+            logging.debug(f"Downloading {link}")
+            start = time.perf_counter()
+            try:
+                res = self._session().get(link, headers=headers, timeout=self.timeout)
+                text = res.text
+            except requests.RequestException as e:
+                raise TransportError(f"{type(e).__name__}: {e}")
+            return PageResponse(url=link,
+                                status_code=res.status_code,
+                                text=text,
+                                headers=res.headers,
+                                elapsed=time.perf_counter() - start,
+                                size=len(res.content))
+
+    def submit(self, link, headers=None):
+        return self.pool.submit(self._download, link, headers)
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+
+class AsyncioTransport(Transport):
+    """Downloads the pages with aiohttp in an event loop running in a
+    background thread. All the requests share one connection pool so many
+    requests can be outstanding over a few keep-alive connections."""
+
+    def __init__(self, workers=1, host_connections=4, rate_limiter=None, timeout=None):
+        """Constructor
+        :param workers int: maximum number of outstanding requests
+        :param host_connections int: maximum number of connections per host
+        :param rate_limiter TokenBucket: limits the number of requests per second
+        :param timeout float: seconds to wait for the server
+        """
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError("The asyncio transport requires the aiohttp package")
+
+        self._aiohttp = aiohttp
+        self._requests = None
+        self.rate_limiter = rate_limiter
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+        async def open_session():
+            connector = aiohttp.TCPConnector(limit=max(workers, host_connections),
+                                             limit_per_host=host_connections)
+            self._requests = asyncio.Semaphore(workers)
+            return aiohttp.ClientSession(connector=connector,
+                                         timeout=aiohttp.ClientTimeout(total=timeout))
+
+        self.session = asyncio.run_coroutine_threadsafe(open_session(), self.loop).result()
+
+    async def _download(self, link, headers=None):
+        async with self._requests:
+            if self.rate_limiter is not None:
+                await asyncio.sleep(self.rate_limiter.reserve())
+            logging.debug(f"Downloading {link}")
+            start = time.perf_counter()
+            try:
+                async with self.session.get(link, headers=headers) as res:
+                    body = await res.read()
+                    # decode as requests does: charset from the headers and
+                    # ISO-8859-1 for text without an explicit charset
+                    encoding = res.charset
+                    if encoding is None:
+                        encoding = 'ISO-8859-1' if res.content_type.startswith('text/') else 'utf-8'
+                    text = body.decode(encoding, errors='replace')
+                    return PageResponse(url=link,
+                                        status_code=res.status,
+                                        text=text,
+                                        headers=res.headers,
+                                        elapsed=time.perf_counter() - start,
+                                        size=len(body))
+            except (self._aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise TransportError(f"{type(e).__name__}: {e}")
+
+    def submit(self, link, headers=None):
+        return asyncio.run_coroutine_threadsafe(self._download(link, headers), self.loop)
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+TRANSPORTS = {'requests': RequestsTransport,
+              'asyncio': AsyncioTransport}
+
+
+class LatencyHistogram:
+    """Counts the requests and their latencies in fixed buckets (seconds)"""
+
+    BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, elapsed):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.BUCKETS, elapsed)] += 1
+            self.total += elapsed
+
+    @property
+    def request_counter(self):
+        return sum(self.counts)
+
+    def __str__(self):
+        counter = self.request_counter
+        mean = self.total / counter if counter else 0.0
+        str_ = "requests: {} - mean latency: {:.3f}s\n".format(counter, mean)
+        labels = ["<= {}s".format(b) for b in self.BUCKETS] + ["> {}s".format(self.BUCKETS[-1])]
+        for label, count in zip(labels, self.counts):
+            str_ += "  {:>9}: {}\n".format(label, count)
+        return str_
+
+
+class Fetcher:
+    """Downloads pages through a transport
+
+    With one worker all the requests are done one after another, otherwise
+    pages can be scheduled with `prefetch` and collected later with `get`.
+    The number of simultaneous connections to the same host is limited by
+    `host_connections`.
+
+    Requests that time out or get a server error are retried with
+    exponential backoff, links that still fail are kept in `dead_letters`.
+    The Retry-After header of 429 and 503 responses replaces the backoff,
+    up to MAX_RETRY_AFTER seconds.
+    """
+
+    # Status codes that are worth retrying
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    # Status codes that can come with a Retry-After header
+    RETRY_AFTER_STATUS = {429, 503}
+
+    # Longest wait requested by a Retry-After header that is honoured, in seconds
+    MAX_RETRY_AFTER = 120.0
+
+    def __init__(self, workers=1, host_connections=4, transport='requests',
+                 rate=None, retries=3, backoff=1.0, timeout=60.0):
+        """Constructor
+        :param workers int: number of concurrent downloads
+        :param host_connections int: maximum number of connections per host
+        :param transport str: name of the transport, one of TRANSPORTS
+        :param rate float: maximum requests per second, None for no limit
+        :param retries int: number of retries of a failed request
+        :param backoff float: seconds to wait before the first retry, doubled on every retry
+        :param timeout float: seconds to wait for the server
+        """
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        rate_limiter = TokenBucket(rate, max(1, workers)) if rate is not None else None
+        self.transport = TRANSPORTS[transport](workers, host_connections, rate_limiter, timeout)
+        self.latency = LatencyHistogram()
+        self.dead_letters = []
+
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def prefetch(self, links):
+        """Schedule the download of the links
+
+        :param links list: the links to download
+        """
+        if self.workers == 1:
+            return
+
+        with self._lock:
+            for link in links:
+                key = page_key(link)
+                if key not in self._futures:
+                    self._futures[key] = self.transport.submit(key)
+
+    def discard(self, links):
+        """Cancels the scheduled downloads of the links that were not collected with `get`
+
+        :param links list: the links passed to `prefetch`
+        :rtype int: the number of downloads discarded
+        """
+        with self._lock:
+            futures = [self._futures.pop(page_key(link), None) for link in links]
+        futures = [future for future in futures if future is not None]
+        for future in futures:
+            future.cancel()
+        return len(futures)
+
+    def get(self, link, headers=None):
+        """Returns the response for the link, waits for the download if the
+        link was already scheduled
+
+        :param link str: link to the page to request
+        :param headers dict: additional headers for the request, they are
+                             ignored if the link was already scheduled
+        :rtype PageResponse: the response from the server
+        :raises FetchError: if the request still fails after all the retries
+        """
+        with self._lock:
+            future = self._futures.pop(page_key(link), None)
+
+        if future is None:
+            future = self.transport.submit(link, headers)
+
+        for attempt in range(self.retries + 1):
+            res = None
+            try:
+                res = future.result()
+                self.latency.add(res.elapsed)
+                if res.status_code not in self.RETRY_STATUS:
+                    return res
+                reason = f"HTTP {res.status_code}"
+            except TransportError as e:
+                reason = str(e)
+
+            if attempt < self.retries:
+                delay = self.retry_delay(attempt, res)
+                logging.warning(f"Retrying {link} in {delay:.1f}s: {reason}")
+                time.sleep(delay)
+                future = self.transport.submit(link, headers)
+
+        self.add_dead_letter(link, reason)
+        raise FetchError(f"{link}: {reason}")
+
+    def retry_delay(self, attempt, res=None):
+        """Returns the seconds to wait before retrying a request
+
+        :param attempt int: number of the failed attempt, starting at 0
+        :param res PageResponse: the failed response, None if the request failed
+        :rtype float: the Retry-After of the response or the exponential backoff
+        """
+        if res is not None and res.status_code in self.RETRY_AFTER_STATUS:
+            retry_after = parse_retry_after(res.headers.get('Retry-After'))
+            if retry_after is not None:
+                return min(retry_after, self.MAX_RETRY_AFTER)
+        return self.backoff * 2 ** attempt * random.uniform(1.0, 1.5)
+
+    def add_dead_letter(self, link, reason):
+        """Records a link that could not be downloaded"""
+        logging.error(f"Giving up on {link}: {reason}")
+        with self._lock:
+            self.dead_letters.append((link, reason))
+
+    def write_dead_letters(self, file_name):
+        """Writes the links that could not be downloaded to a TSV file"""
+        with self._lock:
+            with file_name.open('w', encoding='utf-8') as fd:
+                fd.write("link\treason\n")
+                for (link, reason) in self.dead_letters:
+                    fd.write(f"{link}\t{reason}\n")
+
+    @property
+    def request_counter(self):
+        return self.latency.request_counter
+
+    def close(self):
+        self.transport.close()
@@ -4,14 +4,20 @@ from ufal.morphodita import *
 from pathlib import Path
 
 import argparse
+import hashlib
+import json
 import logging
+import multiprocessing.util
 import pandas as pd
 import sys
 import xmltodict
-import re
 
-from xml.etree.ElementTree import Element, SubElement, Comment, tostring
-from xml.dom import minidom
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from psp_datasets import DATASET_REGEX, find_datasets, load_dataset
+from tagging_cache import TaggingCache, model_version
+from xml_writer import PrettyXmlWriter
 
 
 
@@ -20,6 +26,9 @@ tagger_path = '../nltk_morphodita/czech-morfflex-pdt-161115.tagger'
 
 output_dir = 'xml_output'
 
+# Changing the format of the documents invalidates the fingerprints
+FINGERPRINT_VERSION = 1
+
 years = ["2017_2021", "2013_2017", "2010_2013", "2006_2010",
          "2002_2006", "1998_2002", "1996_1998", "1993_1996"]
 year = "2017"
@@ -35,15 +44,13 @@ periods = {"1993-1996": "../data/psp1993_1996.tsv.xz",
 
 
 def get_input_datasets(input_directory: Path) -> 'list[str]':
-    """Creates a list of input datasets of the form psp<period>.tsv.xz
+    """Creates a list of input datasets of the form psp<period> in any of the
+    formats of psp_datasets, one per period
 
     :params input_directory: `str` path to input directory
     :return: a list of valid input files - including full path
     """
-    regex = re.compile(r'.*psp\d{4}_\d{4}.tsv.xz')
-    ipath = input_directory
-    ifiles = [str(f) for f in ipath.iterdir() if regex.match(str(f))]
-    return ifiles
+    return [str(f) for f in find_datasets(input_directory).values()]
 
 def get_periods(input_dataset_file_names:"list[str]") -> "list[str]":
     """Extracts the period from the dataset file name
@@ -53,8 +60,7 @@ def get_periods(input_dataset_file_names:"list[str]") -> "list[str]":
                                        the datasets
        :return" `list[str]` a list of strings with the period start-end years
     """
-    regex = re.compile(r'.*psp(\d{4}_\d{4}).tsv.xz')
-    return [regex.match(f).groups()[0].replace("_", "-") for f in input_dataset_file_names]
+    return [DATASET_REGEX.search(f).groups()[0].replace("_", "-") for f in input_dataset_file_names]
 
 
 
@@ -74,37 +80,270 @@ def get_speakers(input_path: Path) -> dict:
             
     return speakers_dict
 
-def process(period_list: list, input_directory: Path, output_directory: Path):
-    """Process the data sets passed as arguments
+class CorpusTagger:
+    """Tags the interventions with MorphoDiTa, every process loads its own tagger
 
-    :param period_list: `list` of the periods to process
-    :param output_directory: `Path` path to the output directory
+    With a tagging cache the tagger is only loaded when a text is not found
+    in the cache.
     """
-    morpho = Morpho.load(dict_path)
-    if None == morpho:
-        print("ERROR: Did not load the dictiorary")
 
+    def __init__(self, cache_path: Path = None):
+        """Constructor
+        :param cache_path: `Path` SQLite file of the tagging cache, None for no cache
+        """
+        self.tagger = None
+        self.cache = None
+        if cache_path is not None:
+            self.cache = TaggingCache(cache_path, model_version(tagger_path))
+
+    def load_tagger(self) -> None:
+        self.tagger = Tagger.load(tagger_path)
+        if self.tagger is None:
+            logging.error("Could not load the tagger")
+            sys.exit(-1)
 
-    # TODO: load dataset
-    # TODO: iterate dataset - for each line generate tagged file
-    #    - use name of the original file with xml
-    #    - text file or create XML structucture?
-    #    - create header file; define fields
-    # TODO: create metadatafile
+        morpho = self.tagger.getMorpho()
+        self.converter = TagsetConverter_newStripLemmaIdConverter(morpho)
 
-    tagger = Tagger.load(tagger_path)
-    morpho = tagger.getMorpho()
-    converter = TagsetConverter_newStripLemmaIdConverter(morpho)
+        self.tokenizer = self.tagger.newTokenizer()
+        if self.tokenizer == None:
+            logging.error("Could not open the tokenizer")
+            sys.exit(-1)
 
-    # Load the forms, tokens and lemmas objects, they will be used to return
-    # the values from the tagger
+        # Load the forms, tokens and lemmas objects, they will be used to return
+        # the values from the tagger
+        self.forms = Forms()
+        self.tokens = TokenRanges()
+        self.lemmas = TaggedLemmas()
+
+    def tag_text(self, text: str) -> list:
+        """Tags a text
+
+        :param text: `str` the text of an intervention
+        :return: `list[str]` one vertical per sentence, a line with the token,
+                 lemma and tag for every token
+        """
+        if self.cache is not None:
+            sentences = self.cache.get(text)
+            if sentences is not None:
+                return sentences
+
+        if self.tagger is None:
+            self.load_tagger()
+
+        self.tokenizer.setText(text)
+
+        # for every sentence in intervention
+        sentences = []
+        while self.tokenizer.nextSentence(self.forms, self.tokens):
+            str_ = "\n"
+            self.tagger.tag(self.forms, self.lemmas)
+            for lemma, token in zip(self.lemmas, self.tokens):
+                self.converter.convert(lemma)
+                str_ += f"{text[token.start : token.start + token.length]}\t{lemma.lemma}\t{lemma.tag}\n"
+            sentences.append(str_)
+
+        if self.cache is not None:
+            self.cache.put(text, sentences)
+        return sentences
+
+    def commit(self) -> None:
+        """Writes the new taggings to the cache"""
+        if self.cache is not None:
+            self.cache.commit()
+
+    def close(self) -> None:
+        if self.cache is not None:
+            logging.info(f"Tagging cache hits {self.cache.hits}, misses {self.cache.misses}")
+            self.cache.close()
+            self.cache = None
+
+
+def write_document(corpus_tagger: CorpusTagger, speaker_ids: dict, period: str,
+                   file_id: str, rows: list, output_file: Path) -> None:
+    """Tags the interventions of a session-topic group and writes its XML document
+
+    :param corpus_tagger: `CorpusTagger` the tagger of the process
+    :param speaker_ids: `dict` the speaker ids indexed by name and birth year
+    :param period: `str` the period of the group
+    :param file_id: `str` the id of the document
+    :param rows: `list[dict]` the interventions of the group in order
+    :param output_file: `Path` the XML file
+    """
+    # the document is written while the interventions are tagged, it replaces
+    # the previous version when it is complete
+    tmp_file = output_file.with_suffix(".tmp")
+    with open(tmp_file, "w") as f:
+        xml = PrettyXmlWriter(f, indent="   ")
+
+        first = rows[0]
+        xml.start('doc', {'id':file_id,
+                          'period':period,
+                          'session':str(first['session']),
+                          'start_date':str(first['date']),
+                          'topic':first['topic_str']
+                          }
+                  )
+
+        for row in rows:
+            speaker_id = speaker_ids[(row['name'], str(row['birthyear']))]
+            xml.start('sp', {'id': str(speaker_id),
+                             'speaker': row['name'],
+                             'role': row['function'],
+                             'date': str(row['date']),
+                             'intervention_order': str(row['order']),
+                             'party': row['party']
+                             }
+                      )
+
+            for s_id, str_ in enumerate(corpus_tagger.tag_text(row['text'])):
+                xml.element('s', {'id':f"{s_id + 1:05d}"}, str_)
+            xml.end()
+
+        xml.end()
+
+    tmp_file.replace(output_file)
+    corpus_tagger.commit()
+
+
+# Tagger and speaker ids of the worker processes
+_corpus_tagger = None
+_speaker_ids = None
+
+
+def init_worker(speaker_ids: dict, cache_path: Path, worker: bool = True) -> None:
+    """Creates the tagger of every worker process, it is loaded once. Without
+    workers it is called in the main process
+
+    The workers close their tagging cache when the pool is shut down, the
+    writes of every document are already committed by write_document.
+    """
+    global _corpus_tagger, _speaker_ids
+    _corpus_tagger = CorpusTagger(cache_path)
+    _speaker_ids = speaker_ids
+    if worker:
+        multiprocessing.util.Finalize(None, _corpus_tagger.close, exitpriority=10)
+
+
+def write_document_task(task: tuple) -> tuple:
+    """Writes the document of a group in a worker process"""
+    (period, file_id, rows, output_file, fingerprint) = task
+    write_document(_corpus_tagger, _speaker_ids, period, file_id, rows, output_file)
+    return (file_id, fingerprint)
+
+
+def run_tasks(pool: ProcessPoolExecutor, tasks, window: int):
+    """Yields the results of write_document_task in the order of the tasks,
+    at most window tasks are pending in the pool so the rows of the groups
+    are not all held in memory"""
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.submit(write_document_task, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while len(pending) > 0:
+        yield pending.popleft().result()
+
+
+class CorpusManifest:
+    """Record of the documents stored in the output directory of a period
+
+    For every document the manifest keeps the fingerprint of its input rows,
+    the speaker ids and the tagger version, so an incremental run only writes
+    the documents that changed.
+    """
+
+    def __init__(self, output_path: Path):
+        """Constructor
+        :param output_path: `Path` the output directory of the period
+        """
+        self.file_name = output_path / "manifest.json"
+        self.documents = {}
+        if self.file_name.exists():
+            with self.file_name.open(encoding='utf-8') as fd:
+                self.documents = json.load(fd)["documents"]
+
+    def is_up_to_date(self, file_id: str, fingerprint: str, output_file: Path) -> bool:
+        return self.documents.get(file_id) == fingerprint and output_file.exists()
+
+    def add(self, file_id: str, fingerprint: str) -> None:
+        self.documents[file_id] = fingerprint
+
+    def remove(self, file_id: str) -> None:
+        self.documents.pop(file_id, None)
 
+    def save(self) -> None:
+        tmp_file_name = self.file_name.with_suffix('.tmp')
+        with tmp_file_name.open('w', encoding='utf-8') as fd:
+            json.dump({"documents": self.documents}, fd, indent=1, sort_keys=True)
+        tmp_file_name.replace(self.file_name)
 
+
+def group_fingerprint(rows: list, speaker_ids: dict, tagger_version: str) -> str:
+    """Returns the hash of the input of a document
+
+    :param rows: `list[dict]` the interventions of the group
+    :param speaker_ids: `dict` the speaker ids indexed by name and birth year
+    :param tagger_version: `str` the version of the tagger model
+    """
+    digest = hashlib.sha1(f"{FINGERPRINT_VERSION}|{tagger_version}".encode('utf-8'))
+    for row in rows:
+        speaker_id = speaker_ids.get((row['name'], str(row['birthyear'])))
+        digest.update(json.dumps([row, speaker_id], sort_keys=True, default=str,
+                                 ensure_ascii=False).encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+
+def get_group_tasks(df: pd.DataFrame, period: str, output_path: Path,
+                    speaker_ids: dict, tagger_version: str):
+    """Yields the period, id, rows, output file and fingerprint of every session-topic group
+
+    group by seesion & topic,
+    create ID period_session_topic <- top level ; use this ID as file name
+       store all the interventions from same session-topic group in one file
+       for each intervention create speaker
+           for each sentence create vertical
+    """
+    columns = ['session', 'date', 'topic_str', 'order', 'name', 'birthyear',
+               'function', 'party', 'text']
+    for (session, topic_idx), group in df.groupby(["session", "topic_idx"]):
+        file_id = f"{period}_{session:03d}_{topic_idx:03d}"
+        output_file = output_path / Path(file_id).with_suffix(".xml")
+        rows = group[columns].to_dict('records')
+        yield (period, file_id, rows, output_file,
+               group_fingerprint(rows, speaker_ids, tagger_version))
+
+
+def process(period_list: list, input_directory: Path, output_directory: Path, jobs: int = 1,
+            cache_path: Path = None, force: bool = False):
+    """Process the data sets passed as arguments
+
+    Every session-topic group is written to its own file, with more than one
+    job the groups are tagged in a pool of processes. The output does not
+    depend on the number of jobs.
+
+    The documents whose rows, speaker ids and tagger did not change since the
+    last run are skipped, the documents of groups that no longer exist are
+    removed.
+
+    :param period_list: `list` of the periods to process
+    :param output_directory: `Path` path to the output directory
+    :param jobs: `int` number of tagging processes
+    :param cache_path: `Path` SQLite file of the tagging cache, None for no cache
+    :param force: `bool` write all the documents
+    """
     speaker_ids = get_speakers(input_directory)
     period_files = get_input_datasets(input_directory)
     periods = get_periods(period_files)
-    
-    
+    tagger_version = model_version(tagger_path)
+
+    pool = None
+    if jobs > 1:
+        pool = ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                                   initargs=(speaker_ids, cache_path))
+    else:
+        init_worker(speaker_ids, cache_path, worker=False)
+
     for period, period_file in zip(periods, period_files):
 
         # Process only for the periods in the period list
@@ -112,18 +351,8 @@ def process(period_list: list, input_directory: Path, output_directory: Path):
             continue
         
         logging.info(f"Processing period {period}")
-        
-        forms = Forms()
-        tokens = TokenRanges()
-        lemmas = TaggedLemmas()
 
-
-        tokenizer = tagger.newTokenizer()
-        if tokenizer == None:
-            logging.error("Could not open the tokenizer")
-            sys.exit(-1)
-
-        df = pd.read_csv(period_file, sep='\t', header=0, encoding='utf-8', compression='xz')
+        df = load_dataset(period_file)
 
         # Create one file for every session of the dataframe
         #
@@ -138,67 +367,48 @@ def process(period_list: list, input_directory: Path, output_directory: Path):
         #df.to_csv( output_path / "metadata.csv", sep=',',
         #           columns=metadata_fields, header=True, index=False, encoding='utf-8')
 
-        morpho = tagger.getMorpho()
-        converter = TagsetConverter_newStripLemmaIdConverter(morpho)
-
-        # group by seesion & topic,
-        # create ID period_session_topic <- top level ; use this ID as file name
-        #    store all the interventions from same session-topic group in one file
-        #    for each intervention create speaker
-        #        for each sentence create vertical
-
-        groups = df.groupby(["session", "topic_idx"])
-
-        for (session, topic_idx), group in groups:
-
-            file_id = f"{period}_{session:03d}_{topic_idx:03d}"
-            output_file_name = Path(file_id).with_suffix(".xml")
-
-            doc = None
-            for index, row in group.iterrows():
-
-                # only do for the first row
-                if doc == None:
-                    doc = Element('doc', {'id':file_id,
-                                          'period':period,
-                                          'session':str(row['session']),
-                                          'start_date':str(row['date']),
-                                          'topic':row['topic_str']
-                                          }
-                                  )
-
-                speaker_id = speaker_ids[(row['name'], str(row['birthyear']))]
-                sp = SubElement(doc, 'sp', {'id': str(speaker_id),
-                                            'speaker': row['name'],
-                                            'role': row['function'],
-                                            'date': str(row['date']),
-                                            'intervention_order': str(row['order']),
-                                            'party': row['party']
-                                            }
-                                )
-
-                text = row['text']
-                tokenizer.setText(text)
-                
-                # for every sentence in intervention
-                t = 0
-                s_id = 0
-                while tokenizer.nextSentence(forms, tokens):
-                    s_id += 1
-                    s = SubElement(sp, 's', {'id':f"{s_id:05d}"})
-                    str_ = "\n"
-                    tagger.tag(forms, lemmas)
-                    for i, (lemma, token) in enumerate(zip(lemmas, tokens)):
-                        converter.convert(lemma)
-                        str_ += f"{text[token.start : token.start + token.length]}\t{lemma.lemma}\t{lemma.tag}\n"
-                        t = token.start + token.length
-                    s.text = str_
-
-
-            xmlstr = minidom.parseString(tostring(doc)).toprettyxml(indent="   ")
-                # get filename from row, replace extension and save as xml
-            with open( output_path / output_file_name,  "w") as f:
-                f.write(xmlstr)
+        # remove the documents left by an interrupted run
+        for tmp_file in output_path.glob("*.tmp"):
+            tmp_file.unlink()
+
+        manifest = CorpusManifest(output_path)
+        groups = df[["session", "topic_idx"]].drop_duplicates()
+        current = {f"{period}_{session:03d}_{topic_idx:03d}"
+                   for session, topic_idx in zip(groups["session"], groups["topic_idx"])}
+
+        tasks = (task for task in get_group_tasks(df, period, output_path, speaker_ids, tagger_version)
+                 if force or not manifest.is_up_to_date(task[1], task[4], task[3]))
+        if pool is not None:
+            results = run_tasks(pool, tasks, 4 * jobs)
+        else:
+            results = map(write_document_task, tasks)
+
+        written = 0
+        for (file_id, fingerprint) in results:
+            logging.debug(f"Written {file_id}")
+            manifest.add(file_id, fingerprint)
+            written += 1
+            if written % 100 == 0:
+                manifest.save()
+
+        # remove the documents of the groups that are not in the dataset
+        removed = 0
+        for output_file in output_path.glob(f"{period}_*.xml"):
+            if output_file.stem not in current:
+                output_file.unlink()
+                removed += 1
+        for file_id in list(manifest.documents.keys()):
+            if file_id not in current:
+                manifest.remove(file_id)
+        manifest.save()
+
+        logging.info(f"Period {period}: {written} documents written, "
+                     f"{len(current) - written} up to date, {removed} removed")
+
+    if pool is not None:
+        pool.shutdown()
+    else:
+        _corpus_tagger.close()
 
 
 def check_period(period: str) -> bool:
@@ -226,6 +436,15 @@ def parse_args() -> set:
     parser.add_argument('-a', '--all', action='store_true', default=False,
                         dest='all_periods',
                         help=f'Create a corpus for all periods')
+    parser.add_argument('-j', '--jobs', action='store', default=1, type=int,
+                        dest='jobs',
+                        help='number of tagging processes')
+    parser.add_argument('-c', '--tag-cache', action='store', default=None,
+                        dest='tag_cache',
+                        help='SQLite file with the tagged texts, texts found in it are not tagged again')
+    parser.add_argument('-f', '--force', action='store_true', default=False,
+                        dest='force',
+                        help='write all the documents, also the ones that are up to date')
 
 
     args = parser.parse_args()
@@ -249,7 +468,8 @@ def parse_args() -> set:
     else:
         process_periods = [args.year]
         
-    return (process_periods, Path(args.input_directory), Path(args.output_directory))
+    return (process_periods, Path(args.input_directory), Path(args.output_directory), args.jobs,
+            Path(args.tag_cache) if args.tag_cache is not None else None, args.force)
         
 
 if __name__ == "__main__":
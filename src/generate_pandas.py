@@ -16,23 +16,168 @@ Permissions of this strong copyleft license are conditioned on making available
 
 from pathlib import Path
 import argparse
+import hashlib
+import io
+import lzma
+import multiprocessing
 
 import pandas as pd
 import numpy as np
 import sys
 import datetime
 
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from psp_datasets import CATEGORICAL_COLUMNS
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Directory with the interventions tables written by download_stenos
+INTERVENTIONS_DIRECTORY = "interventions"
+
+# Output formats and the extensions of the output file
+OUTPUT_FORMATS = {'xz': '.tsv.xz',
+                  'zstd': '.tsv.zst',
+                  'parquet': '.parquet',
+                  'arrow': '.arrow'}
+
+
+def join_lines(lines):
+    """Joins the lines of an intervention into one text"""
+    parts = []
+    for line in lines:
+        if line[0] == ':':
+            line += line[1:].strip()
+        parts.append(line)
+    return "".join(parts)
+
+
+def count_tokens(text):
+    """Returns the number of tokens of a text, same as len(text.split(' '))"""
+    return text.count(' ') + 1
+
+
+def read_raw_text(file_name):
+    """Returns the contents of an intervention file or None if it does not exist"""
+    try:
+        with file_name.open() as fd:
+            return fd.read()
+    except FileNotFoundError:
+        return None
+
+
+def normalize_text(raw):
+    """Joins the lines of an intervention and counts its tokens
+
+    :param raw str: contents of the intervention, None if it was not found
+    :rtype tuple: the text and the number of tokens, None if raw is None
+    """
+    if raw is None:
+        return None
+    text = join_lines(io.StringIO(raw))
+    return (text, count_tokens(text))
+
+
+class DataFrameWriter:
+    """Writes a data frame to a file in one of the OUTPUT_FORMATS, the data
+    frame can be written in chunks
+
+    - xz        TSV compressed with xz, readable by pd.read_csv
+    - zstd      TSV compressed with multithreaded zstd, readable by pd.read_csv
+    - parquet   Parquet with zstd, keeps the dates and categories
+    - arrow     Arrow IPC (feather) with zstd, keeps the dates and categories
+    """
+
+    def __init__(self, output_file, output_format):
+        """Constructor
+        :param output_file pathlib.Path: the output file
+        :param output_format str: one of OUTPUT_FORMATS
+        """
+        if output_format in ('parquet', 'arrow') and pa is None:
+            raise ImportError("The {} output format requires the pyarrow package".format(output_format))
+        if output_format == 'zstd' and zstandard is None:
+            raise ImportError("The zstd output format requires the zstandard package")
+
+        self.output_file = output_file
+        self.output_format = output_format
+        self.header = True
+        self._fd = None
+        self._writer = None
+
+        if output_format == 'xz':
+            self._fd = lzma.open(output_file, 'wt', encoding='utf-8', newline='')
+        elif output_format == 'zstd':
+            compressor = zstandard.ZstdCompressor(level=10, threads=-1)
+            self._fd = io.TextIOWrapper(compressor.stream_writer(output_file.open('wb')),
+                                        encoding='utf-8', newline='')
+
+    def _open_table(self, df):
+        # the schema is taken from the first chunk, columns without values are strings
+        schema = pa.Schema.from_pandas(df, preserve_index=False)
+        for idx, field in enumerate(schema):
+            if pa.types.is_null(field.type):
+                schema = schema.set(idx, field.with_type(pa.string()))
+
+        if self.output_format == 'parquet':
+            self._writer = pa.parquet.ParquetWriter(str(self.output_file), schema, compression='zstd')
+        else:
+            self._writer = pa.ipc.new_file(str(self.output_file), schema,
+                                           options=pa.ipc.IpcWriteOptions(compression='zstd'))
+
+    def write(self, df):
+        if self._fd is not None:
+            df.to_csv(self._fd, sep='\t', header=self.header, index=False)
+        else:
+            if self._writer is None:
+                self._open_table(df)
+            self._writer.write_table(pa.Table.from_pandas(df, schema=self._writer.schema,
+                                                          preserve_index=False))
+        self.header = False
+
+    def close(self):
+        if self._fd is not None:
+            self._fd.close()
+        if self._writer is not None:
+            self._writer.close()
+
+
 class GeneratePandasDataFrame:
-    def __init__(self, input_path, output_path, pickle_name="pickled_df"):
+    def __init__(self, input_path, output_path, pickle_name="pickled_df", jobs=1,
+                 output_format='xz'):
         """Constructor
         :param input_path pathlib.Path: path ot input directory
         :param output_path pathlib.Path: path to output directory
+        :param jobs int: number of threads reading the files and of processes joining the lines
+        :param output_format str: one of OUTPUT_FORMATS
         """
         self.df = None
         self.names = None
+        self.speakers = None
+        self.unmatched_names = []
+        self.integer_birthyear = True
+        self.integer_age = True
+        self.categories = {}
         self.input_path = input_path
         self.output_path = output_path
         self.pickle_name = pickle_name
+        self.jobs = jobs
+        self.output_format = output_format
+        self._threads = None
+        self._processes = None
+
+        # texts of the last interventions table read
+        self._table_session = None
+        self._table_texts = {}
 
     def read_summary(self):
         """Read the summary file in the input directory and create a data frame"""
@@ -46,37 +191,87 @@ class GeneratePandasDataFrame:
         with names_summary.open() as fd:
             self.names = pd.read_csv(fd, sep='\t', header=0)
 
-    def read_file_contents(self):
-
-        #files = {x for x in self.input_path.iterdir() if x.suffix == '.txt'}
-        found_files = 0
+    def read_session_table(self, session):
+        """Reads the texts of a session from its parquet or arrow table
+        :param session int: the session number
+        :rtype dict: the texts indexed by file name, empty if there is no table
+        """
+        directory = self.input_path / INTERVENTIONS_DIRECTORY
+        for (suffix, read_table) in (('.parquet', pd.read_parquet), ('.arrow', pd.read_feather)):
+            table_file = directory / "s_{:03d}{}".format(session, suffix)
+            if table_file.exists():
+                table = read_table(table_file, columns=['file_name', 'text'])
+                return dict(zip(table.file_name, table.text))
+        return {}
+
+    def read_raw_texts(self, df):
+        """Returns the contents of the interventions in the data frame, None
+        for the interventions that are not found
+
+        download_stenos writes the texts in one table per session or in one
+        file per intervention, only the table of the current session is kept
+        in memory. The files are read by a pool of threads.
+        """
+        if not self.input_path.joinpath(INTERVENTIONS_DIRECTORY).exists():
+            file_names = [self.input_path.joinpath(f) for f in df['file_name']]
+            if self.jobs > 1:
+                if self._threads is None:
+                    self._threads = ThreadPoolExecutor(max_workers=self.jobs)
+                return list(self._threads.map(read_raw_text, file_names))
+            return [read_raw_text(f) for f in file_names]
+
+        raw = []
+        for (session, file_name) in zip(df['session'], df['file_name']):
+            if session != self._table_session:
+                self._table_texts = self.read_session_table(session)
+                self._table_session = session
+            raw.append(self._table_texts.get(file_name))
+        return raw
+
+    def read_texts(self, df):
+        """Reads the texts of the interventions in the data frame, with more
+        than one job the lines are joined in a pool of processes
+
+        :param df pandas.DataFrame: rows of the files summary
+        :rtype tuple: list with the texts and list with their number of tokens
+        """
+        raw = self.read_raw_texts(df)
+        if self.jobs > 1:
+            if self._processes is None:
+                # spawn, the reader threads may hold locks when the pool is forked
+                self._processes = ProcessPoolExecutor(max_workers=self.jobs,
+                                                      mp_context=multiprocessing.get_context('spawn'))
+            chunksize = max(1, len(raw) // (4 * self.jobs))
+            results = self._processes.map(normalize_text, raw, chunksize=chunksize)
+        else:
+            results = map(normalize_text, raw)
 
         txt = []
-
-
-        for file_name in self.df['file_name']:
-            ifile = self.input_path.joinpath(file_name)
-
-            if ifile.exists():
-                found_files += 1
-
-                #with self.input_path.joinpath(file_name).open() as fd:
-                with ifile.open() as fd:
-                    tmp_txt = ""
-                    for line in fd.readlines():
-                        if line[0] == ':':
-                            line += line[1:].strip()
-                        tmp_txt += line
-                    txt.append(tmp_txt)
-            else:
+        tokens = []
+        for (file_name, result) in zip(df['file_name'], results):
+            if result is None:
                 print("Can not parse file: {}".format(file_name))
-                txt.append("")
-
-        self.df.loc[:,"text"] = pd.Series(txt, index=self.df.index)
-        self.df.loc[:,"tokens"] = self.df["text"].apply(lambda x : len(x.split(sep=' ')))
-        self.df.loc[:,"date"] = self.df["date"].apply(lambda x : pd.to_datetime(x, format="%Y%m%d"))
-        self.df.steno_name = self.df.steno_name.apply(lambda x : x.replace('_', ' ').lower())
-        self.df.steno_name = self.df.steno_name.apply(lambda x : x.replace('  ', ' '))
+                result = ("", count_tokens(""))
+            txt.append(result[0])
+            tokens.append(result[1])
+        return (txt, tokens)
+
+    def close(self):
+        """Shuts down the pools of threads and processes"""
+        if self._threads is not None:
+            self._threads.shutdown()
+            self._threads = None
+        if self._processes is not None:
+            self._processes.shutdown()
+            self._processes = None
+
+    def prepare_metadata(self):
+        """Normalizes the dates and speaker names of the files summary and
+        the speakers metadata used by merge_names_information"""
+        self.df["date"] = pd.to_datetime(self.df["date"].astype(str), format="%Y%m%d")
+        self.df["steno_name"] = (self.df.steno_name.str.replace('_', ' ', regex=False)
+                                                   .str.lower()
+                                                   .str.replace('  ', ' ', regex=False))
 
         if (not int == self.names.dtypes["birthdate"]) and (not float == self.names.dtypes["birthdate"]):
             self.names.birthdate = self.names.birthdate.apply(lambda x : x.replace('-', ''))
@@ -85,10 +280,65 @@ class GeneratePandasDataFrame:
         self.names["name"] = self.names.name.apply(lambda x: x.strip())
         self.names["function"] = self.names.function.apply(lambda x: x.lower().strip())
 
-        self.merge_names_information()
+        # One row per steno name, if a steno name is repeated the last row is used
+        speakers = self.names.assign(steno_name=self.names.steno_name.str.lower(),
+                                     birthyear=self.names.birthdate.dt.year)
+        self.speakers = speakers.drop_duplicates('steno_name', keep='last').set_index('steno_name')
+
+        self.unmatched_names = sorted(set(self.speakers.index) - set(self.df.steno_name))
+        if len(self.unmatched_names) > 0:
+            print("Speakers in the metadata not found in the stenos: {}".format(self.unmatched_names))
 
+        # decided on the whole summary so every chunk gets the same column types:
+        # years are integers unless there are speakers without birth date
+        matched = self.speakers.index.isin(self.df.steno_name)
+        self.integer_birthyear = not self.speakers.birthyear[matched].isnull().any()
+        # ages are floats once any speaker is matched, as the baseline loop upcast them
+        self.integer_age = not matched.any()
+
+        # same categories for all the chunks, the speakers without metadata get ""
+        self.categories = {column: pd.CategoricalDtype(sorted(set(self.speakers[column].dropna()) | {""}))
+                           for column in CATEGORICAL_COLUMNS}
+
+    def read_file_contents(self):
+        self.prepare_metadata()
 
-    def merge_names_information(self):
+        (txt, tokens) = self.read_texts(self.df)
+        self.df["text"] = txt
+        self.df["tokens"] = tokens
+
+        self.df = self.merge_names_information(self.df)
+
+    def iter_chunks(self, chunk_size):
+        """Reads the texts and merges the speakers information chunk_size rows
+        at a time, the memory used does not depend on the size of the period
+
+        Duplicated interventions are removed as in remove_duplicates, only
+        a hash of the rows already seen is kept.
+
+        :param chunk_size int: number of rows of every chunk
+        :rtype generator: the data frames of the chunks
+        """
+        self.prepare_metadata()
+
+        seen = set()
+        for start in range(0, len(self.df), chunk_size):
+            chunk = self.df.iloc[start:start + chunk_size].copy()
+            (txt, tokens) = self.read_texts(chunk)
+            chunk["text"] = txt
+            chunk["tokens"] = tokens
+            chunk = self.merge_names_information(chunk)
+
+            keep = []
+            for (session, topic_idx, name, text) in zip(chunk.session, chunk.topic_idx,
+                                                        chunk.name, chunk.text):
+                key = (session, topic_idx, None if pd.isnull(name) else name,
+                       hashlib.sha1(text.encode('utf-8')).digest())
+                keep.append(key not in seen)
+                seen.add(key)
+            yield chunk[keep]
+
+    def merge_names_information(self, df):
         """Create and populate new columns
            - age
            - sex
@@ -96,34 +346,28 @@ class GeneratePandasDataFrame:
            - function
            - replace name with filtered one
            -
+        :param df pandas.DataFrame: the interventions, all of them or a chunk
+        :rtype pandas.DataFrame: the interventions with the speakers information
         """
-        self.df["function"] = ""
-        self.df["birthyear"] = 0
-        self.df["age"] = 0
-        self.df["sex"] = ""
-        self.df["titles"] = ""
-        self.df["party"] = ""
-
-        grp = self.df.groupby('steno_name')
-        for nidx, steno_name in self.names.steno_name.iteritems():
-            try:
-                idx = grp.groups[steno_name.lower()]
-                self.df.loc[idx, "function"] = self.names.loc[nidx, "function"]
-                self.df.loc[idx,"birthyear"] = self.names.loc[nidx,"birthdate"].year
-                self.df.loc[idx,"age"] = self.names.loc[nidx,"age"]
-                self.df.loc[idx,"sex"] = self.names.loc[nidx,"sex"]
-                self.df.loc[idx,"name"] = self.names.loc[nidx,"name"]
-                self.df.loc[idx,"titles"] = self.names.loc[nidx,"titles"]
-                self.df.loc[idx,"party"] = self.names.loc[nidx,"party"]
-            except KeyError:
-                print(f"KeyError: {nidx=} :: {steno_name=}")
-                print(f"KeyError: {self.df.loc[nidx]=}")
+        # values for the rows without metadata, the name is kept
+        defaults = {"function": "", "birthyear": 0, "age": 0, "sex": "",
+                    "name": df["name"], "titles": "", "party": ""}
+
+        info = df[["steno_name"]].join(self.speakers[list(defaults.keys())], on="steno_name")
+        matched = df.steno_name.isin(self.speakers.index)
+        for column, default in defaults.items():
+            df[column] = info[column].where(matched, default)
+
+        if self.integer_birthyear:
+            df["birthyear"] = df.birthyear.astype(int)
+        if self.integer_age:
+            df["age"] = df.age.astype(int)
 
         # Move the text column to the last column of the data frame
         column_names = ['session', 'date', 'topic_idx', 'topic_str', 'order', 'name',
                         'steno_name', 'function', 'file_name', 'tokens', 'birthyear', 'age', 'sex',
                         'titles', 'party', 'text']
-        self.df = self.df[column_names]
+        return df[column_names]
 
     def transform_function(self, f):
         """Transform female function titles into male for easy searching"""
@@ -138,37 +382,57 @@ class GeneratePandasDataFrame:
         self.df = self.df.drop_duplicates(['session', 'topic_idx', 'name', 'text'], keep='first')
 
 
+    def output_file(self):
+        return self.output_path.joinpath(self.pickle_name + OUTPUT_FORMATS[self.output_format])
+
+    def set_categories(self, df):
+        """Stores the columns with few values as categories in the binary formats"""
+        if self.output_format in ('parquet', 'arrow'):
+            df = df.astype(self.categories)
+        return df
+
     def save_tsv(self):
 
         if not self.output_path.exists():
             self.output_path.mkdir(parents = True)
 
+        writer = DataFrameWriter(self.output_file(), self.output_format)
+        writer.write(self.set_categories(self.df))
+        writer.close()
+
+    def save_tsv_chunks(self, chunk_size):
+        """Same output as read_file_contents, remove_duplicates and save_tsv,
+        the chunks are appended to the output file as they are read"""
+
+        if not self.output_path.exists():
+            self.output_path.mkdir(parents = True)
 
-        self.df.to_csv(str(self.output_path.joinpath(self.pickle_name + '.tsv.xz')),
-                       encoding='utf-8',
-                       sep='\t',
-                       header=True,
-                       compression='xz',
-                       index=False)
+        writer = DataFrameWriter(self.output_file(), self.output_format)
+        for chunk in self.iter_chunks(chunk_size):
+            writer.write(self.set_categories(chunk))
+            self.report_problems(chunk)
+        writer.close()
 
+    def report_problems(self, df=None):
+        if df is None:
+            df = self.df
 
-    def report_problems(self):
-        if not (self.df.sex.isnull() == False).all():
+        if not (df.sex.isnull() == False).all():
             print("WARNING: Rows with NULL is sex field\n\n")
-            print(self.df[self.df.sex.isnull() == False])
+            print(df[df.sex.isnull() == False])
 
-        if not (self.df.text.isnull() == False).all():
+        if not (df.text.isnull() == False).all():
             print("WARNING: Rows with NULL is text field\n\n")
-            print(self.df[self.df.text.isnull() == False])
+            print(df[df.text.isnull() == False])
 
-        if not ((self.df.birthyear == 0) == False).all():
+        if not ((df.birthyear == 0) == False).all():
             print("WARNING: Missing birthyears\n\n")
-            print(set(self.df[self.df.birthyear == 0].steno_name))
+            print(set(df[df.birthyear == 0].steno_name))
 
 
-        if not (self.df.name.isnull() == False).all():
+        if not (df.name.isnull() == False).all():
             print("WARNING: names with NULL is text field\n\n")
-            print(self.df[self.df.name.isnull() == False])
+            print(df[df.name.isnull() == False])
             
 
 
@@ -183,6 +447,15 @@ def parse_args():
     parser.add_argument('-f', '--output-filename',action='store', default='pickled_df',
                         dest='output_file_name',
                         help='output file name')
+    parser.add_argument('-c', '--chunk-size', action='store', default=None, type=int,
+                        dest='chunk_size',
+                        help='read and write CHUNK_SIZE interventions at a time to bound the memory used')
+    parser.add_argument('-j', '--jobs', action='store', default=1, type=int,
+                        dest='jobs',
+                        help='number of threads reading the files and of processes joining the lines')
+    parser.add_argument('-F', '--output-format', action='store', default='xz',
+                        choices=list(OUTPUT_FORMATS.keys()), dest='output_format',
+                        help='xz or zstd compressed TSV, parquet or arrow, default xz')
 
     args = parser.parse_args()
 
@@ -200,10 +473,16 @@ if __name__ == "__main__":
 
     gen = GeneratePandasDataFrame(Path(args.input_directory),
                                   Path(args.output_directory),
-                                  args.output_file_name)
+                                  args.output_file_name,
+                                  args.jobs,
+                                  args.output_format)
 
     gen.read_summary()
-    gen.read_file_contents()
-    gen.remove_duplicates()
-    gen.save_tsv()
-    gen.report_problems()
+    if args.chunk_size is None:
+        gen.read_file_contents()
+        gen.remove_duplicates()
+        gen.save_tsv()
+        gen.report_problems()
+    else:
+        gen.save_tsv_chunks(args.chunk_size)
+    gen.close()
@@ -13,23 +13,22 @@
 from pathlib import Path
 import argparse
 import sys
-import re
+
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
-from xml.etree.ElementTree import Element, SubElement, tostring
-from xml.dom import minidom
+from psp_datasets import DATASET_REGEX, find_datasets, load_dataset
+from xml_writer import PrettyXmlWriter
 
 
 def get_input_datasets(input_directory: str) -> 'list[str]':
-    """Creates a list of input datasets of the form psp<period>.tsv.xz
+    """Creates a list of input datasets of the form psp<period> in any of the
+    formats of psp_datasets, one per period
 
     :params input_directory: `str` path to input directory
     :return: a list of valid input files - including full path
     """
-    regex = re.compile(r'.*psp\d{4}_\d{4}.tsv.xz')
-    ipath = Path(input_directory)
-    ifiles = [str(f) for f in ipath.iterdir() if regex.match(str(f))]
-    return ifiles
+    return [str(f) for f in find_datasets(input_directory).values()]
     
 
 def get_role_from_steno_name(steno_name, name):
@@ -47,65 +46,90 @@ def get_periods(input_dataset_file_names:"list[str]") -> "list[str]":
                                        the datasets
        :return" `list[str]` a list of strings with the period start-end years
     """
-    regex = re.compile(r'.*psp(\d{4}_\d{4}).tsv.xz')
-    return [regex.match(f).groups()[0].replace("_", "-") for f in input_dataset_file_names]
+    return [DATASET_REGEX.search(f).groups()[0].replace("_", "-") for f in input_dataset_file_names]
+
+def get_period_speakers(period_file: str) -> dict:
+    """Extracts the sex, party and roles of the speakers of one period, only
+       the needed columns of the dataset are loaded.
+
+       :param period_file: `str` the input file containing the dataset
+       :return: a dictionary indexed by name and birth year, sorted by the index
+    """
+    psp = load_dataset(period_file, columns=["name", "birthyear", "function", "party", "sex"])
+
+    # rows without name or birth year are not grouped
+    psp = psp.dropna(subset=["name", "birthyear"])
+    psp = psp.assign(function=psp["function"].str.lower())
+
+    first = psp.drop_duplicates(["name", "birthyear"], keep="first").sort_values(["name", "birthyear"])
+    speakers = {(name, birthyear): {"sex": sex, "party": party, "role": set()}
+                for name, birthyear, sex, party in zip(first["name"], first["birthyear"],
+                                                       first["sex"], first["party"])}
+
+    roles = psp[["name", "birthyear", "function"]].drop_duplicates()
+    for name, birthyear, role in zip(roles["name"], roles["birthyear"], roles["function"]):
+        speakers[(name, birthyear)]["role"].add(role)
+    return speakers
+
 
-def get_speakers_dictionary(period_file_names: list) -> dict:
+def get_speakers_dictionary(period_file_names: list, jobs: int = 1) -> dict:
     """Parses the datasets passed in periords to extract the speakers field,
        adds the speaker, and attributes to a dictionary, the key to the dictionary
        is a tupple of the name and brith year.
 
        :param period_file_names: `list[str]1 is a list of the input files containing the datasets
                                   to process
+       :param jobs: `int` number of periods processed in parallel
        :return: a dictionary with the speakers and the attributes
 
     """
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            period_speakers = list(pool.map(get_period_speakers, period_file_names))
+    else:
+        period_speakers = [get_period_speakers(f) for f in period_file_names]
+
+    # the ids are assigned in the order of the periods and the speakers
     speakers = {}
     user_id = 1
     periods = get_periods(period_file_names)
-    for period_file, period_year in zip(period_file_names, periods):
-        
-        psp = pd.read_csv(period_file, compression="xz", encoding='utf-8', sep="\t", header=0)
-        groups = psp.groupby(["name", "birthyear"])
+    for period_year, period in zip(periods, period_speakers):
 
         # index is a tupple, [name, birthyear]
-        for index, group in groups:
-            #steno_names = set(group.steno_name)
-            roles =   set(group["function"].apply(lambda x: x.lower()).values) #get_role_from_steno_name(role, index[0]) for role in steno_names]
-
+        for index, info in period.items():
             if index not in speakers:
                 speakers[index] = {"id": user_id,
-                                   "sex": group.iloc[0].sex}
+                                   "sex": info["sex"]}
                 user_id += 1
-            speakers[index][period_year] = {"party": group.iloc[0].party,
-                                            "role": roles}
+            speakers[index][period_year] = {"party": info["party"],
+                                            "role": info["role"]}
     return speakers
 
 
-def get_xml_element(speaker_dict: dict, periods: list) -> Element:
-    """Convert the speaker dictionary into a DOM Element
+def write_xml(speaker_dict: dict, periods: list, xml: PrettyXmlWriter) -> None:
+    """Write the speaker dictionary as XML elements
        :param speaker_dict: `dict` a dictionary containing the speaker parsed info.
        :param periods" `list[str]` a list of strings contining the years
-
-       :return: `Element`
+       :param xml: `PrettyXmlWriter` the writer of the output file
        """
-    doc = Element('parlament_speakers')
-    
+    xml.start('parlament_speakers')
+
     for index in sorted(speaker_dict.keys()):
         info = speaker_dict[index]
-        sk = SubElement(doc, 'speaker', {'id': str(info["id"]),
-                                         'gender': info["sex"],
-                                         'birth_year': str(index[1])})
-        sk.text = index[0]
+        xml.start('speaker', {'id': str(info["id"]),
+                              'gender': info["sex"],
+                              'birth_year': str(index[1])},
+                  index[0])
 
         for period in periods:
             if period in info.keys():
-                p = SubElement(sk, 'period', {'years': period,
-                                              'party': info[period]['party']})
+                xml.start('period', {'years': period,
+                                     'party': info[period]['party']})
                 for role_id, role in enumerate(sorted(info[period]['role'])):
-                    r = SubElement(p, 'role', {'id': str(role_id+1)})
-                    r.text = role      # add .title() if capitalization is needed
-    return doc
+                    xml.element('role', {'id': str(role_id+1)}, role)      # add .title() if capitalization is needed
+                xml.end()
+        xml.end()
+    xml.end()
 
 
 def get_pandas_dataset(speaker_dict: dict, periods: list) -> pd.DataFrame:
@@ -144,6 +168,9 @@ def parse_args():
     parser.add_argument('-f', '--output-filename',action='store', default='psp_steno_speaker_db',
                         dest='output_file_name',
                         help='output file name')
+    parser.add_argument('-j', '--jobs', action='store', default=1, type=int,
+                        dest='jobs',
+                        help='number of periods processed in parallel')
 
     args = parser.parse_args()
 
@@ -164,12 +191,14 @@ def parse_args():
 
     return args
 
-def write_output_xml_file(output_directory: str, output_file_name: str, xmlstr: str) -> None:
+def write_output_xml_file(output_directory: str, output_file_name: str,
+                          speaker_dict: dict, periods: list) -> None:
     """Writes the output file in the specified path
 
        :param output_directory: `str` storing the path for the output directory
        :param output_file_name: `str` storing the name of the file (with no extension)
-       :param xmlstr: `str` storing the contents of the file
+       :param speaker_dict: `dict` a dictionary containing the speaker parsed info.
+       :param periods" `list[str]` a list of strings contining the years
     """
 
     path = Path(output_directory)
@@ -177,7 +206,7 @@ def write_output_xml_file(output_directory: str, output_file_name: str, xmlstr:
         path.mkdir(parents=True)
     
     with open( path / (output_file_name + ".xml"),  "w") as f:
-        f.write(xmlstr)
+        write_xml(speaker_dict, periods, PrettyXmlWriter(f, indent="  "))
 
 
 def write_output_tsv_file(output_directory: str, output_file_name: str, df: pd.DataFrame) -> None:
@@ -194,13 +223,11 @@ if __name__ == "__main__":
 
     input_datasets = get_input_datasets(args.input_directory)
     periods = get_periods(input_datasets)
-    speakers = get_speakers_dictionary(input_datasets)
+    speakers = get_speakers_dictionary(input_datasets, args.jobs)
 
 
     if args.format_output_as_xml:
-        doc =get_xml_element(speakers, periods)
-        xmlstr = minidom.parseString(tostring(doc)).toprettyxml(indent="  ")
-        write_output_xml_file(args.output_directory, args.output_file_name, xmlstr)
+        write_output_xml_file(args.output_directory, args.output_file_name, speakers, periods)
     else:
         df = get_pandas_dataset(speakers, periods)
         write_output_tsv_file(args.output_directory, args.output_file_name, df)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: instrumentation
+
+   :synopsis: Timers and counters of the stages of download_stenos, used to
+              find out if a crawl is bound by the network, the HTML parser
+              or the disk.
+
+   Stages:
+
+    - fetch        waiting for the server
+    - cache        reading and writing the page cache
+    - html_parse   building the BeautifulSoup trees
+    - extraction   extracting the interventions from the steno pages
+    - write        writing the intervention files and the reports
+
+   The stage times are added across threads and processes, with several
+   workers their sum can be larger than the elapsed time.
+
+.. moduleauthor:: Manuel Berrocal <mbercas@gmail.com>
+
+"""
+"""
+GNU General Public License v3.0
+Permissions of this strong copyleft license are conditioned on making available complete source code of licensed works and modifications, which include larger works using a licensed work, under the same license. Copyright and license notices must be preserved. Contributors provide an express grant of patent rights.
+"""
+
+import json
+import threading
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class Instrumentation:
+    """Collects the time spent in every stage and counters of the crawl"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = defaultdict(float)
+        self.counters = defaultdict(int)
+        self._lock = threading.Lock()
+        self._progress = None
+        self._stop = threading.Event()
+
+    @contextmanager
+    def timer(self, stage):
+        """Context manager that adds the time spent in the block to the stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def add_time(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] += seconds
+
+    def count(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] += value
+
+    def summary(self):
+        """Returns a dictionary with the stage times, counters and rates"""
+        with self._lock:
+            elapsed = time.perf_counter() - self.start
+            counters = dict(self.counters)
+            stages = {stage: round(seconds, 3) for stage, seconds in self.stages.items()}
+
+        lookups = counters.get('cache_hits', 0) + counters.get('cache_misses', 0)
+        pages = counters.get('topic_pages', 0) + counters.get('steno_pages', 0)
+        return {'elapsed': round(elapsed, 3),
+                'stages': stages,
+                'counters': counters,
+                'cache_hit_ratio': round(counters.get('cache_hits', 0) / lookups, 4) if lookups else 0.0,
+                'pages_per_second': round(pages / elapsed, 3) if elapsed > 0 else 0.0,
+                'downloaded_mb_per_second': round(counters.get('bytes_downloaded', 0) / 2**20 / elapsed, 3)
+                                            if elapsed > 0 else 0.0}
+
+    def progress_line(self):
+        summary = self.summary()
+        counters = summary['counters']
+        stages = " ".join(f"{stage} {seconds:.0f}s" for stage, seconds in sorted(summary['stages'].items()))
+        return ("[{:.0f}s] sessions {} - pages {} ({:.1f} pages/s) - cache hits {:.0%} - "
+                "downloaded {:.1f} MB - {}").format(summary['elapsed'],
+                                                    counters.get('sessions', 0),
+                                                    counters.get('topic_pages', 0) + counters.get('steno_pages', 0),
+                                                    summary['pages_per_second'],
+                                                    summary['cache_hit_ratio'],
+                                                    counters.get('bytes_downloaded', 0) / 2**20,
+                                                    stages)
+
+    def start_progress(self, interval):
+        """Prints a progress line every interval seconds in a background thread"""
+        def report():
+            while not self._stop.wait(interval):
+                print(self.progress_line(), flush=True)
+
+        self._progress = threading.Thread(target=report, daemon=True)
+        self._progress.start()
+
+    def stop_progress(self):
+        if self._progress is not None:
+            self._stop.set()
+            self._progress.join()
+            self._progress = None
+
+    def write_json(self, file_name):
+        """Writes the summary to a JSON file"""
+        with open(file_name, 'w', encoding='utf-8') as fd:
+            json.dump(self.summary(), fd, indent=2)
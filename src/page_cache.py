@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: page_cache
+
+   :synopsis: Caches of the pages downloaded by download_stenos
+
+   Two backends are available:
+
+    - DirectoryCache   one UTF-8 file per page mirroring the path of the URL,
+                       this is the original layout of the `.cache` directory
+    - SqliteCache      compressed pages in a single SQLite file, the pages are
+                       stored by content hash and indexed by URL
+
+   The module can also be run as a script to import a cache directory into
+   an SQLite cache and to evict old entries:
+
+    python page_cache.py migrate .cache pages.sqlite
+    python page_cache.py evict pages.sqlite --max-size 2000 --max-age 365
+
+.. moduleauthor:: Manuel Berrocal <mbercas@gmail.com>
+
+"""
+"""
+GNU General Public License v3.0
+Permissions of this strong copyleft license are conditioned on making available complete source code of licensed works and modifications, which include larger works using a licensed work, under the same license. Copyright and license notices must be preserved. Contributors provide an express grant of patent rights.
+"""
+
+import argparse
+import hashlib
+import logging
+import lzma
+import sqlite3
+import sys
+import threading
+import time
+
+from collections import namedtuple
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+CachedPage = namedtuple('CachedPage', ['text', 'etag', 'last_modified', 'fetched'])
+
+
+class DirectoryCache:
+    """Stores every page as a UTF-8 file, the path of the file is the URL of the page"""
+
+    def __init__(self, path=Path('.') / '.cache', max_age=None):
+        """Constructor
+        :param path pathlib.Path: the cache directory
+        :param max_age float: seconds after which a page is requested again, None for never
+        """
+        self.path = path
+        self.max_age = max_age
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def file_name(self, link):
+        """Returns the path of the page in the cache directory"""
+        file_str = link.replace('http://public.psp.cz/eknih/', '')
+        return self.path / file_str
+
+    def link(self, file_name):
+        """Returns the link of a file in the cache directory, inverse of `file_name`"""
+        file_str = file_name.relative_to(self.path).as_posix()
+        for scheme in ('http:/', 'https:/'):
+            if file_str.startswith(scheme):
+                return scheme + '/' + file_str[len(scheme):]
+        return 'http://public.psp.cz/eknih/' + file_str
+
+    def __contains__(self, link):
+        return self.file_name(link).exists()
+
+    def get(self, link):
+        """Returns the cached page or None if the link is not in the cache"""
+        file_name = self.file_name(link)
+        if not file_name.exists():
+            return None
+        return CachedPage(text=file_name.read_text(encoding='utf-8'),
+                          etag=None,
+                          last_modified=None,
+                          fetched=file_name.stat().st_mtime)
+
+    def put(self, link, text, headers=None):
+        file_name = self.file_name(link)
+        file_name.parents[0].mkdir(parents=True, exist_ok=True)
+        file_name.write_text(text, encoding='utf-8')
+
+    def touch(self, link):
+        self.file_name(link).touch()
+
+    def is_stale(self, page):
+        return self.max_age is not None and time.time() - page.fetched > self.max_age
+
+    def iter_files(self):
+        """Iterates all the cached files"""
+        return (f for f in self.path.rglob('*') if f.is_file())
+
+    def close(self):
+        pass
+
+
+class SqliteCache:
+    """Stores the pages compressed in an SQLite database
+
+    The contents are stored once per content hash, so pages with identical
+    contents share storage. The table of pages maps every URL to the hash
+    and keeps the ETag and Last-Modified headers for revalidation.
+
+    If a page is not found and a fallback cache directory is given, the page
+    is read from the directory and imported.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY,
+                                          codec TEXT NOT NULL,
+                                          size INTEGER NOT NULL,
+                                          data BLOB NOT NULL);
+        CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY,
+                                          digest TEXT NOT NULL REFERENCES blobs(digest),
+                                          etag TEXT,
+                                          last_modified TEXT,
+                                          fetched REAL NOT NULL,
+                                          accessed REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS pages_digest ON pages(digest);
+    """
+
+    # The access times of the pages read are written every ACCESS_BATCH hits
+    ACCESS_BATCH = 500
+
+    # migrate commits a transaction every MIGRATE_BATCH pages
+    MIGRATE_BATCH = 1000
+
+    def __init__(self, path, codec='xz', fallback=None, max_age=None):
+        """Constructor
+        :param path pathlib.Path: the SQLite file
+        :param codec str: compression of new pages, 'xz' or 'zstd'
+        :param fallback DirectoryCache: cache directory read when a page is not found
+        :param max_age float: seconds after which a page is revalidated, None for never
+        """
+        if codec == 'zstd' and zstandard is None:
+            raise ImportError("The zstd codec requires the zstandard package")
+        if codec not in ('xz', 'zstd'):
+            raise ValueError(f"Unknown codec {codec}")
+
+        self.path = path
+        self.codec = codec
+        self.fallback = fallback
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._accessed = {}
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.db.executescript(self.SCHEMA)
+        self.db.commit()
+
+    def _compress(self, data):
+        if self.codec == 'zstd':
+            return zstandard.ZstdCompressor(level=10).compress(data)
+        return lzma.compress(data, preset=6)
+
+    def _decompress(self, codec, data):
+        if codec == 'zstd':
+            if zstandard is None:
+                raise ImportError("Reading zstd pages requires the zstandard package")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return lzma.decompress(data)
+
+    def __contains__(self, link):
+        with self._lock:
+            row = self.db.execute("SELECT 1 FROM pages WHERE url = ?", (link,)).fetchone()
+        if row is not None:
+            return True
+        return self.fallback is not None and link in self.fallback
+
+    def get(self, link):
+        """Returns the cached page or None if the link is not in the cache"""
+        with self._lock:
+            row = self.db.execute("""SELECT blobs.codec, blobs.data, pages.etag,
+                                            pages.last_modified, pages.fetched
+                                     FROM pages JOIN blobs ON pages.digest = blobs.digest
+                                     WHERE pages.url = ?""", (link,)).fetchone()
+            if row is not None:
+                self._accessed[link] = time.time()
+                if len(self._accessed) >= self.ACCESS_BATCH:
+                    self._write_accessed()
+                    self.db.commit()
+
+        if row is not None:
+            (codec, data, etag, last_modified, fetched) = row
+            return CachedPage(text=self._decompress(codec, data).decode('utf-8'),
+                              etag=etag,
+                              last_modified=last_modified,
+                              fetched=fetched)
+
+        if self.fallback is not None:
+            page = self.fallback.get(link)
+            if page is not None:
+                logging.debug(f"{link} ...importing from {self.fallback.path}")
+                self.put(link, page.text, fetched=page.fetched)
+                return page
+        return None
+
+    def put(self, link, text, headers=None, fetched=None, commit=True):
+        """Stores the page
+
+        :param link str: the link of the page
+        :param text str: the contents of the page
+        :param headers dict: the headers of the response, for the validators
+        :param fetched float: time the page was downloaded, default now
+        :param commit bool: commit the page, False to batch several pages and
+                            call `commit` after the last one
+        """
+        data = text.encode('utf-8')
+        digest = hashlib.sha1(data).hexdigest()
+        headers = headers if headers is not None else {}
+        now = time.time()
+        fetched = fetched if fetched is not None else now
+
+        with self._lock:
+            exists = self.db.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            if exists is None:
+                self.db.execute("INSERT INTO blobs VALUES (?, ?, ?, ?)",
+                                (digest, self.codec, len(data), self._compress(data)))
+            self.db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                            (link, digest, headers.get('ETag'), headers.get('Last-Modified'),
+                             fetched, now))
+            if commit:
+                self.db.commit()
+
+    def commit(self):
+        """Commits the pages stored with commit=False"""
+        with self._lock:
+            self.db.commit()
+
+    def _write_accessed(self):
+        """Writes the pending access times, the caller holds the lock and commits"""
+        self.db.executemany("UPDATE pages SET accessed = ? WHERE url = ?",
+                            [(accessed, url) for (url, accessed) in self._accessed.items()])
+        self._accessed.clear()
+
+    def touch(self, link):
+        """Marks the page as revalidated"""
+        with self._lock:
+            self.db.execute("UPDATE pages SET fetched = ? WHERE url = ?", (time.time(), link))
+            self.db.commit()
+
+    def is_stale(self, page):
+        return self.max_age is not None and time.time() - page.fetched > self.max_age
+
+    def evict(self, max_size=None, max_age=None):
+        """Removes pages from the cache
+
+        :param max_size int: maximum size of the stored pages in bytes (compressed),
+                             the least recently accessed pages are removed first
+        :param max_age float: pages downloaded more than max_age seconds ago are removed
+        :rtype int: the number of pages removed
+        """
+        removed = 0
+        with self._lock:
+            self._write_accessed()
+            if max_age is not None:
+                cur = self.db.execute("DELETE FROM pages WHERE fetched < ?",
+                                      (time.time() - max_age,))
+                removed += cur.rowcount
+                self._remove_orphan_blobs()
+
+            if max_size is not None:
+                (size,) = self.db.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM blobs").fetchone()
+                # a blob is freed when the last page that references it is removed
+                references = dict(self.db.execute("SELECT digest, COUNT(*) FROM pages GROUP BY digest"))
+                pages = self.db.execute("""SELECT pages.url, pages.digest, LENGTH(blobs.data)
+                                           FROM pages JOIN blobs ON pages.digest = blobs.digest
+                                           ORDER BY pages.accessed""")
+                expired = []
+                for (url, digest, blob_size) in pages:
+                    if size <= max_size:
+                        break
+                    expired.append((url,))
+                    references[digest] -= 1
+                    if references[digest] == 0:
+                        size -= blob_size
+                self.db.executemany("DELETE FROM pages WHERE url = ?", expired)
+                removed += len(expired)
+                self._remove_orphan_blobs()
+
+            self.db.commit()
+        return removed
+
+    def _remove_orphan_blobs(self):
+        self.db.execute("DELETE FROM blobs WHERE digest NOT IN (SELECT digest FROM pages)")
+
+    def migrate(self, directory_cache):
+        """Imports all the pages of a cache directory
+
+        :param directory_cache DirectoryCache: the cache to import
+        :rtype int: the number of imported pages
+        """
+        count = 0
+        for file_name in directory_cache.iter_files():
+            link = directory_cache.link(file_name)
+            self.put(link, file_name.read_text(encoding='utf-8'),
+                     fetched=file_name.stat().st_mtime, commit=False)
+            count += 1
+            if count % self.MIGRATE_BATCH == 0:
+                self.commit()
+                print(f"Imported {count} pages")
+        self.commit()
+        return count
+
+    def close(self):
+        with self._lock:
+            self._write_accessed()
+            self.db.commit()
+            self.db.close()
+
+
+def open_cache(backend='directory', path=None, codec='xz', max_age=None):
+    """Creates the page cache used by the SessionParser
+
+    :param backend str: 'directory' or 'sqlite'
+    :param path str: path to the cache directory or SQLite file
+    :param codec str: compression used by the SQLite cache
+    :param max_age float: seconds after which a page is revalidated, None for never
+    :rtype: a DirectoryCache or SqliteCache
+    """
+    directory = DirectoryCache(Path('.') / '.cache', max_age)
+    if backend == 'directory':
+        if path is not None:
+            directory = DirectoryCache(Path(path), max_age)
+        return directory
+
+    path = Path(path) if path is not None else Path('.') / 'pages.sqlite'
+    return SqliteCache(path, codec, fallback=directory, max_age=max_age)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Manage the page cache of download_stenos')
+    commands = parser.add_subparsers(dest='command')
+
+    migrate = commands.add_parser('migrate', help='import a cache directory into an SQLite cache')
+    migrate.add_argument('directory', help='cache directory')
+    migrate.add_argument('database', help='SQLite cache file')
+    migrate.add_argument('-c', '--codec', action='store', default='xz',
+                         choices=['xz', 'zstd'], dest='codec',
+                         help='compression of the pages, default xz')
+
+    evict = commands.add_parser('evict', help='remove pages from an SQLite cache')
+    evict.add_argument('database', help='SQLite cache file')
+    evict.add_argument('--max-size', action='store', default=None, type=int,
+                       dest='max_size',
+                       help='maximum size of the cache in MB')
+    evict.add_argument('--max-age', action='store', default=None, type=float,
+                       dest='max_age',
+                       help='remove pages downloaded more than MAX_AGE days ago')
+
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        sys.exit(-1)
+    return args
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    if args.command == 'migrate':
+        if not Path(args.directory).exists():
+            print(f"Error: can not find cache directory {args.directory}")
+            sys.exit(-1)
+        cache = SqliteCache(Path(args.database), args.codec)
+        count = cache.migrate(DirectoryCache(Path(args.directory)))
+        print(f"Imported {count} pages into {args.database}")
+    else:
+        cache = SqliteCache(Path(args.database))
+        max_size = args.max_size * 1024 * 1024 if args.max_size is not None else None
+        max_age = args.max_age * 24 * 3600 if args.max_age is not None else None
+        removed = cache.evict(max_size, max_age)
+        print(f"Removed {removed} pages from {args.database}")
+    cache.close()
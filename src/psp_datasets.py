@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: psp_datasets
+
+   :synopsis: Loads the period datasets psp<yyyy>_<yyyy> created by
+              generate_pandas in any of its output formats, .tsv.xz,
+              .tsv.zst, .parquet or .arrow. The first time a TSV dataset is
+              loaded a parquet copy is written to a cache directory, later
+              loads read the copy instead of decompressing and parsing the
+              TSV file again.
+
+   The copy is named after the path of the source file and keyed by its size
+   and modification time, when the source changes a new copy is created and
+   the old copy of the same source is removed. Only the requested
+   columns are read from the copy and the columns function, sex and party are
+   returned as categories.
+
+    import psp_datasets
+
+    df = psp_datasets.load_period("2017-2021", columns=["name", "birthyear", "party"])
+
+   The cache directory is $PSP_CZ_CACHE or ~/.cache/psp_cz. Without pyarrow
+   the TSV file is read every time, the parquet and arrow datasets require
+   pyarrow. If a period is stored in several formats the first one of
+   DATASET_SUFFIXES is loaded.
+
+.. moduleauthor:: Manuel Berrocal <mbercas@gmail.com>
+
+"""
+"""
+GNU General Public License v3.0
+Permissions of this strong copyleft license are conditioned on making available complete source code of licensed works and modifications, which include larger works using a licensed work, under the same license. Copyright and license notices must be preserved. Contributors provide an express grant of patent rights.
+"""
+
+import glob
+import hashlib
+import logging
+import os
+import re
+
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+# Directory with the datasets of the repository
+DATA_DIRECTORY = Path(__file__).resolve().parents[1] / "data"
+
+PERIODS = ["1993-1996", "1996-1998", "1998-2002", "2002-2006",
+           "2006-2010", "2010-2013", "2013-2017", "2017-2021"]
+
+# Columns returned as categories
+CATEGORICAL_COLUMNS = ['function', 'sex', 'party']
+
+# Changing the format of the cached copies invalidates the old ones
+CACHE_VERSION = 1
+
+# Extensions of the output formats of generate_pandas, in order of preference
+DATASET_SUFFIXES = ['.parquet', '.arrow', '.tsv.zst', '.tsv.xz']
+
+# Compression of the TSV datasets
+TSV_COMPRESSION = {'.tsv.zst': 'zstd', '.tsv.xz': 'xz'}
+
+DATASET_REGEX = re.compile(r'psp(\d{4}_\d{4})(\.parquet|\.arrow|\.tsv\.zst|\.tsv\.xz)$')
+
+
+def cache_directory():
+    """Returns the directory with the cached copies of the datasets"""
+    return Path(os.environ.get("PSP_CZ_CACHE", Path.home() / ".cache" / "psp_cz"))
+
+
+def period_file_name(period, suffix='.tsv.xz'):
+    """Returns the file name of the dataset of a period, i.e. 2017-2021 -> psp2017_2021.tsv.xz"""
+    return "psp{}{}".format(period.replace("-", "_"), suffix)
+
+
+def dataset_suffix(file_name):
+    """Returns the extension of a dataset file, one of DATASET_SUFFIXES"""
+    for suffix in DATASET_SUFFIXES:
+        if str(file_name).endswith(suffix):
+            return suffix
+    raise ValueError(f"Unknown dataset format: {file_name}")
+
+
+def find_datasets(input_directory=DATA_DIRECTORY):
+    """Returns the datasets found in a directory
+
+    :param input_directory pathlib.Path: directory with the datasets
+    :rtype dict: the paths of the datasets indexed by period, sorted by period,
+                 for every period the preferred format of DATASET_SUFFIXES
+    """
+    datasets = {}
+    for file_name in Path(input_directory).iterdir():
+        match = DATASET_REGEX.match(file_name.name)
+        if match:
+            datasets.setdefault(match.groups()[0].replace("_", "-"), []).append(file_name)
+    return {period: min(files, key=lambda f: DATASET_SUFFIXES.index(dataset_suffix(f)))
+            for (period, files) in sorted(datasets.items())}
+
+
+def source_id(file_name, parse_dates=None):
+    """Returns the id of a dataset file, the same for all its cached copies"""
+    source = "{}|{}".format(file_name.resolve(), parse_dates)
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+
+
+def source_key(file_name, parse_dates=None):
+    """Returns the key of the cached copy of a dataset file"""
+    stat = file_name.stat()
+    key = "{}|{}|{}|{}|{}".format(file_name.resolve(), stat.st_size, stat.st_mtime_ns,
+                                  parse_dates, CACHE_VERSION)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def cache_file_name(file_name, parse_dates=None):
+    """Returns the path of the cached copy of a dataset file,
+    <name>-<source id>-<source key>.parquet"""
+    name = file_name.name.split(".")[0]
+    return cache_directory() / "{}-{}-{}.parquet".format(name, source_id(file_name, parse_dates),
+                                                          source_key(file_name, parse_dates))
+
+
+def set_categories(df):
+    """Converts the categorical columns present in the data frame"""
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    return df
+
+
+def read_tsv(file_name, columns=None, parse_dates=None):
+    """Reads a TSV dataset, the compression is deduced from the extension"""
+    df = pd.read_csv(file_name, sep='\t', header=0, encoding='utf-8',
+                     usecols=columns, parse_dates=parse_dates,
+                     compression=TSV_COMPRESSION.get(dataset_suffix(file_name)))
+    if columns is not None:
+        df = df[columns]
+    return set_categories(df)
+
+
+def read_table(file_name, columns=None, parse_dates=None):
+    """Reads a parquet or arrow dataset, the dates and categories are stored
+    in the file, the columns in parse_dates that are not dates are converted"""
+    if pyarrow is None:
+        raise ImportError(f"Reading {file_name} requires the pyarrow package")
+    if dataset_suffix(file_name) == '.parquet':
+        df = pd.read_parquet(file_name, columns=columns)
+    else:
+        df = pd.read_feather(file_name, columns=columns)
+    for column in parse_dates or []:
+        if column in df.columns and not pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = pd.to_datetime(df[column])
+    return set_categories(df)
+
+
+def write_cached_copy(df, cache_file):
+    """Writes the parquet copy of a dataset and removes the older copies of the same source"""
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_suffix(".tmp")
+    df.to_parquet(tmp_file, compression='zstd', index=False)
+    os.replace(tmp_file, cache_file)
+
+    # the name and the source id, the key has no "-"
+    prefix = cache_file.name.rsplit("-", 1)[0]
+    for old_file in cache_file.parent.glob(glob.escape(prefix) + "-*.parquet"):
+        if old_file != cache_file:
+            old_file.unlink()
+
+
+def load_dataset(file_name, columns=None, parse_dates=None, use_cache=True):
+    """Loads a dataset file, the format is deduced from the extension
+
+    :param file_name str: path of the dataset, with one of DATASET_SUFFIXES
+    :param columns list: columns to load, None for all of them
+    :param parse_dates list: columns with dates, as in pd.read_csv
+    :param use_cache bool: read and create the cached parquet copy of a TSV file
+    :rtype pandas.DataFrame: the dataset, function, sex and party are categories
+    """
+    file_name = Path(file_name)
+    if dataset_suffix(file_name) not in TSV_COMPRESSION:
+        return read_table(file_name, columns, parse_dates)
+    if pyarrow is None or not use_cache:
+        return read_tsv(file_name, columns, parse_dates)
+
+    cache_file = cache_file_name(file_name, parse_dates)
+    if cache_file.exists():
+        logging.debug(f"Reading {file_name} from {cache_file}")
+        return set_categories(pd.read_parquet(cache_file, columns=columns))
+
+    logging.info(f"Creating cached copy of {file_name} in {cache_file}")
+    df = read_tsv(file_name, parse_dates=parse_dates)
+    write_cached_copy(df, cache_file)
+    if columns is not None:
+        df = df[columns]
+    return df
+
+
+def load_period(period, columns=None, input_directory=DATA_DIRECTORY, use_cache=True):
+    """Loads the dataset of a period
+
+    :param period str: the period, one of PERIODS
+    :param columns list: columns to load, None for all of them
+    :param input_directory pathlib.Path: directory with the datasets
+    :param use_cache bool: read and create the cached parquet copy
+    :rtype pandas.DataFrame: the dataset, function, sex and party are categories
+    """
+    datasets = find_datasets(input_directory)
+    if period not in datasets:
+        raise FileNotFoundError(f"No dataset of period {period} in {input_directory}")
+    return load_dataset(datasets[period], columns, use_cache=use_cache)
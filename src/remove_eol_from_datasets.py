@@ -4,6 +4,8 @@
 
 import pandas as pd
 
+from psp_datasets import load_dataset
+
 periods = [("1993-1996", "../data/psp1993_1996.tsv.xz") ,
            ("1996-1998", "../data/psp1996_1998.tsv.xz"),
            ("1998-2002", "../data/psp1998_2002.tsv.xz"),
@@ -23,7 +25,7 @@ if __name__ == "__main__":
 
         print(f"Removing EOL from {fn} creating new file: {new_fn}")
         
-        data = pd.read_csv(fn, compression='xz', sep='\t', encoding='utf-8')
+        data = load_dataset(fn)
         data.text = data["text"].apply(lambda x : x.replace('\n', ' ').strip())
        
 
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: tagging_cache
+
+   :synopsis: Cache of the MorphoDiTa output used by generate_corpus_input_files.
+              The tagged sentences of a text are stored compressed in an SQLite
+              file, indexed by the hash of the text and the version of the
+              tagger model, so texts that did not change and repeated texts
+              are tagged only once.
+
+   The version of the model is the hash of the tagger file, replacing the
+   model invalidates the cached taggings. Several processes can share the
+   cache file.
+
+.. moduleauthor:: Manuel Berrocal <mbercas@gmail.com>
+
+"""
+"""
+GNU General Public License v3.0
+Permissions of this strong copyleft license are conditioned on making available complete source code of licensed works and modifications, which include larger works using a licensed work, under the same license. Copyright and license notices must be preserved. Contributors provide an express grant of patent rights.
+"""
+
+import hashlib
+import json
+import lzma
+import sqlite3
+
+from pathlib import Path
+
+
+def text_digest(text):
+    """Returns the hash of a text"""
+    return hashlib.sha1(text.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def model_version(model_file):
+    """Returns the hash of the contents of a tagger model file"""
+    digest = hashlib.sha1()
+    with Path(model_file).open('rb') as fd:
+        for block in iter(lambda: fd.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TaggingCache:
+    """Stores the tagged sentences of the texts in an SQLite database"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS taggings (digest TEXT NOT NULL,
+                                             model TEXT NOT NULL,
+                                             data BLOB NOT NULL,
+                                             PRIMARY KEY (digest, model));
+    """
+
+    def __init__(self, path, model):
+        """Constructor
+        :param path pathlib.Path: the SQLite file
+        :param model str: the version of the tagger model
+        """
+        self.path = path
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+
+        self.db = sqlite3.connect(str(path), timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(self.SCHEMA)
+        self.db.commit()
+
+    def get(self, text):
+        """Returns the tagged sentences of the text or None if the text is not in the cache"""
+        row = self.db.execute("SELECT data FROM taggings WHERE digest = ? AND model = ?",
+                              (text_digest(text), self.model)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(lzma.decompress(row[0]).decode('utf-8'))
+
+    def put(self, text, sentences):
+        """Stores the tagged sentences of the text, they are written on `commit`
+
+        :param text str: the tagged text
+        :param sentences list: the verticals of the sentences
+        """
+        data = lzma.compress(json.dumps(sentences, ensure_ascii=False).encode('utf-8'), preset=6)
+        self.db.execute("INSERT OR REPLACE INTO taggings VALUES (?, ?, ?)",
+                        (text_digest(text), self.model, data))
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: xml_writer
+
+   :synopsis: Writes indented XML documents element by element to a file,
+              the output is the same as serializing an ElementTree with
+              `tostring` and pretty printing it with
+              `minidom.parseString(...).toprettyxml(indent)` but the document
+              is never kept in memory.
+
+    with open("doc.xml", "w") as fd:
+        xml = PrettyXmlWriter(fd, indent="  ")
+        xml.start("doc", {"id": "1"})
+        xml.element("s", {"id": "00001"}, "text")
+        xml.end()
+
+   An element with only text is written in one line, the text of an element
+   with children is written in its own indented line as minidom does.
+
+   tests/test_xml_writer.py compares the output with minidom.
+
+.. moduleauthor:: Manuel Berrocal <mbercas@gmail.com>
+
+"""
+"""
+GNU General Public License v3.0
+Permissions of this strong copyleft license are conditioned on making available complete source code of licensed works and modifications, which include larger works using a licensed work, under the same license. Copyright and license notices must be preserved. Contributors provide an express grant of patent rights.
+"""
+
+
+def escape(data):
+    """Escapes text and attribute values as minidom does"""
+    return data.replace("&", "&amp;").replace("<", "&lt;"). \
+                replace("\"", "&quot;").replace(">", "&gt;")
+
+
+def normalize_text(text):
+    """Line ends of text are normalized when minidom parses the document"""
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+class PrettyXmlWriter:
+    """Streams an indented XML document to a file object
+
+    The start tag of an element is completed when its first child is
+    started or when the element is ended, so elements without children are
+    written as `<tag/>` or with their text in the same line.
+    """
+
+    def __init__(self, fd, indent="\t"):
+        """Constructor
+        :param fd file: text file object where the document is written
+        :param indent str: indentation added on every level
+        """
+        self.fd = fd
+        self.indent = indent
+        self._stack = []
+        self._pending = False
+        self.fd.write('<?xml version="1.0" ?>\n')
+
+    def _complete_parent(self):
+        """Writes the end of the start tag of the parent and its text"""
+        if self._pending:
+            (tag, text) = self._stack[-1]
+            self.fd.write(">\n")
+            if text:
+                self.fd.write(escape(self.indent * len(self._stack) + text + "\n"))
+            self._pending = False
+
+    def start(self, tag, attrib=None, text=None):
+        """Starts an element
+
+        :param tag str: the element name
+        :param attrib dict: the attributes, written in insertion order
+        :param text str: the text of the element
+        """
+        self._complete_parent()
+        self.fd.write(self.indent * len(self._stack) + "<" + tag)
+        if attrib:
+            for (name, value) in attrib.items():
+                self.fd.write(" {}=\"{}\"".format(name, escape(value)))
+        self._stack.append((tag, normalize_text(text) if text else None))
+        self._pending = True
+
+    def end(self):
+        """Ends the last started element"""
+        (tag, text) = self._stack.pop()
+        if self._pending:
+            if text:
+                self.fd.write(">" + escape(text) + "</" + tag + ">\n")
+            else:
+                self.fd.write("/>\n")
+            self._pending = False
+        else:
+            self.fd.write(self.indent * len(self._stack) + "</" + tag + ">\n")
+
+    def element(self, tag, attrib=None, text=None):
+        """Writes an element without children"""
+        self.start(tag, attrib, text)
+        self.end()
+
+    def write_tree(self, element):
+        """Writes an ElementTree element and its children, tails are ignored"""
+        self.start(element.tag, element.attrib, element.text)
+        for child in element:
+            self.write_tree(child)
+        self.end()
+
@@ -0,0 +1,133 @@
+"""
+Local stand-in of psp.cz for the tests of download_stenos. The pages of a
+small 2017 period are served from memory by an http.server in a thread and
+the crawler is run as a script with -u pointing to it.
+"""
+
+import re
+import subprocess
+import sys
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+
+SPEAKERS = {401: ("Ing. Radek Vondráček", "Předseda PSP Radek Vondráček", "9. 3. 1973", "ANO 2011"),
+            6138: ("Jana Černochová", "Poslankyně Jana Černochová", "26. 10. 1973", "ODS"),
+            5900: ("Mgr. Jan Bartošek", "Místopředseda PSP Jan Bartošek", "3. 6. 1971", "KDU-ČSL")}
+
+
+def steno_page(session, page, speaker_ids):
+    """A steno page with one intervention per speaker"""
+    paragraphs = []
+    for (r_id, speaker_id) in enumerate(speaker_ids, 1):
+        steno_name = SPEAKERS[speaker_id][1]
+        paragraphs.append(f'<p align="justify"><b><a id="r{r_id}" href="/sqw/detail.sqw?id={speaker_id}">'
+                          f'{steno_name}</a>:</b> Intervence {r_id} na straně {page} schůze {session}.</p>'
+                          f'<p align="justify">Druhý odstavec intervence {r_id}.</p>')
+    return ('<html><head><title>Stenografický zápis</title></head><body>'
+            '<div id="main-content"><p align="center"><b>Záhlaví</b></p>'
+            + "".join(paragraphs) + '</div></body></html>')
+
+
+def topic_page(session, day, topics):
+    """A topic page, topics is a list of (q id, steno page, number of interventions)"""
+    links = []
+    for (q_id, steno, count) in topics:
+        links.append(f'<p><a name="{q_id}"></a><b>Bod {q_id}</b></p><p>')
+        links.extend(f'<a href="{steno}#r{r}">Řečník {r}</a> ' for r in range(1, count + 1))
+        links.append('</p>')
+    return (f'<html><head><title>Stenografický zápis {session}. schůze, {day}. listopadu 2017'
+            '</title></head><body>' + "".join(links) + '</body></html>')
+
+
+def psp_site():
+    """Returns the pages of the site indexed by path and query"""
+    base = "/2017ps/stenprot/"
+    pages = {base + "index.htm": '<html><body><a href="001schuz/index.htm">1. schůze</a>'
+                                 '<a href="002schuz/index.htm">2. schůze</a></body></html>'}
+    for session in (1, 2):
+        prefix = f"{base}{session:03d}schuz/"
+        pages[prefix + "index.htm"] = (
+            '<html><body>'
+            # the navigation links to a topic page with another fragment
+            f'<div class="nav"><a href="{session}-2.html#q9">21. listopadu</a></div>'
+            f'<p><a id="b1" name="b1"></a><b>1. Zahájení {session}. schůze</b> '
+            f'<a href="{session}-1.html#q1">20. listopadu</a></p>'
+            f'<p><a id="b2" name="b2"></a><b>2. Návrh zákona</b> '
+            f'<a href="{session}-1.html#q2">20. listopadu</a> '
+            '<a href="/sqw/historie.sqw?o=8&amp;t=1">historie</a> '
+            f'<a href="{session}-2.html#q3">21. listopadu</a></p>'
+            '</body></html>')
+        pages[prefix + f"{session}-1.html"] = topic_page(session, 20, [("q1", f"s{session:03d}001.htm", 2),
+                                                                       ("q2", f"s{session:03d}002.htm", 3)])
+        pages[prefix + f"{session}-2.html"] = topic_page(session, 21, [("q3", f"s{session:03d}003.htm", 2)])
+        pages[prefix + f"s{session:03d}001.htm"] = steno_page(session, 1, [401, 6138])
+        pages[prefix + f"s{session:03d}002.htm"] = steno_page(session, 2, [401, 5900, 6138])
+        pages[prefix + f"s{session:03d}003.htm"] = steno_page(session, 3, [5900, 401])
+
+    for (speaker_id, (name, _, born, party)) in SPEAKERS.items():
+        pages[f"/sqw/detail.sqw?id={speaker_id}"] = (
+            f'<html><body><h1>{name}</h1><div class="figcaption">'
+            f'Narozen: {born} Zvolen na kandidátce: {party}</div></body></html>')
+    return pages
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = re.sub('/+', '/', self.path)
+        with self.server.lock:
+            self.server.requests.append(path)
+            page = self.server.pages.get(path)
+        if page is None:
+            self.send_error(404)
+            return
+        body = page.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def psp_server():
+    """Serves the pages of psp_site, `pages` can be changed by the test and
+    `requests` lists the paths requested"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SiteHandler)
+    server.pages = psp_site()
+    server.requests = []
+    server.lock = threading.Lock()
+    server.url = "http://127.0.0.1:{}".format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def run_crawler(server, directory, *args):
+    """Runs download_stenos on the 2017 period of the server, the output,
+    cache and log are written in directory
+
+    :rtype subprocess.CompletedProcess: the result of the run
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    command = [sys.executable, str(SRC / "download_stenos.py"), "-y", "2017", "-u", server.url,
+               "-o", "out", "-r", "1000", "--retries", "0", *args]
+    return subprocess.run(command, cwd=directory, capture_output=True, text=True, timeout=300)
+
+
+def output_files(directory):
+    """Returns the contents of the files written by the crawler, indexed by name"""
+    output = directory / "out"
+    return {f.relative_to(output).as_posix(): f.read_bytes()
+            for f in sorted(output.rglob('*')) if f.is_file()}
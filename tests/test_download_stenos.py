@@ -0,0 +1,55 @@
+"""
+Runs download_stenos against the local stand-in of psp.cz in conftest.
+"""
+
+from collections import Counter
+
+import pytest
+
+from conftest import run_crawler, output_files
+
+
+def test_crawl_writes_all_the_interventions(psp_server, tmp_path):
+    result = run_crawler(psp_server, tmp_path)
+    assert result.returncode == 0, result.stderr
+
+    with (tmp_path / "out" / "file_summary.tsv").open(encoding='utf-8') as fd:
+        rows = [line.rstrip('\n').split('\t') for line in fd][1:]
+    # two sessions with 2 + 3 + 2 interventions
+    assert [row[0] for row in rows] == ['1'] * 7 + ['2'] * 7
+    assert {row[5] for row in rows} == {'Radek Vondráček', 'Jana Černochová', 'Jan Bartošek'}
+
+
+@pytest.mark.parametrize("options", [["-w", "4"], ["-w", "4", "-j", "2"]])
+def test_workers_give_the_same_output(psp_server, tmp_path, options):
+    result = run_crawler(psp_server, tmp_path / "sequential", "-w", "1")
+    assert result.returncode == 0, result.stderr
+    psp_server.requests.clear()
+
+    result = run_crawler(psp_server, tmp_path / "concurrent", *options)
+    assert result.returncode == 0, result.stderr
+
+    assert output_files(tmp_path / "concurrent") == output_files(tmp_path / "sequential")
+
+    # the topic and steno pages are prefetched, every page is downloaded once
+    requests = Counter(path for path in psp_server.requests if "schuz/" in path)
+    assert max(requests.values()) == 1
+
+
+def test_incremental_run_keeps_sessions_that_can_not_be_downloaded(psp_server, tmp_path):
+    result = run_crawler(psp_server, tmp_path)
+    assert result.returncode == 0, result.stderr
+    before = output_files(tmp_path)
+
+    del psp_server.pages["/2017ps/stenprot/001schuz/index.htm"]
+    # without the cached pages the session could not be parsed again
+    result = run_crawler(psp_server, tmp_path, "-i", "--cache-path", "empty_cache")
+    assert result.returncode == 0, result.stderr
+
+    after = output_files(tmp_path)
+    assert after["file_summary.tsv"] == before["file_summary.tsv"]
+    # the session page is reported as failed, the files of the session are kept
+    assert b"001schuz/index.htm" in after.pop("dead_letter.tsv")
+    assert after == before
+    log = (tmp_path / "download_stenos.log").read_text(encoding='utf-8')
+    assert "keeping the stored session" in log
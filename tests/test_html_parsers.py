@@ -0,0 +1,63 @@
+"""
+Checks that html5lib and lxml extract the same interventions from the steno
+and topic pages in tests/fixtures, with the code of compare_html_parsers.
+"""
+
+import sys
+
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from compare_html_parsers import session_parsers, parse_steno_page, parse_topic_page
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+# page, year of the session and parse function
+PAGES = [("s001001.htm", 2017, parse_steno_page),
+         ("s013005.htm", 1996, parse_steno_page),
+         ("001schuz_1.html", 2017, parse_topic_page)]
+
+
+@pytest.fixture(scope="module")
+def sessions(tmp_path_factory):
+    """One session parser per year and HTML parser, shared by all the pages"""
+    cache_directory = tmp_path_factory.mktemp("cache")
+    parsers = {year: session_parsers(year, ['html5lib', 'lxml'], cache_directory)
+               for year in {year for (_, year, _) in PAGES}}
+    yield parsers
+    for by_parser in parsers.values():
+        for session in by_parser.values():
+            session.fetcher.close()
+
+
+@pytest.mark.parametrize("page,year,parse", PAGES)
+def test_parsers_extract_the_same_interventions(sessions, page, year, parse):
+    text = (FIXTURES / page).read_text(encoding='utf-8')
+    html5lib_result = parse(sessions[year]['html5lib'], text)
+    lxml_result = parse(sessions[year]['lxml'], text)
+
+    assert all(len(part) > 0 for part in html5lib_result)
+    assert html5lib_result == lxml_result
+
+
+def test_steno_page_interventions(sessions):
+    text = (FIXTURES / "s001001.htm").read_text(encoding='utf-8')
+    (interventions, speakers) = parse_steno_page(sessions[2017]['lxml'], text)
+
+    assert list(interventions.keys()) == ['r1', 'r2', 'r3']
+    assert interventions['r1'].text == ("Vážené paní poslankyně, vážení páni poslanci, zahajuji schůzi.\n"
+                                        "Prosím, abyste se posadili a zaznamenali svou přítomnost.")
+    assert interventions['r2'].text == ("Děkuji za slovo, pane předsedo.\n"
+                                        "Navrhuji doplnit pořad schůze.")
+    assert list(speakers.keys()) == ['Předseda_PSP_Radek_Vondráček', 'Poslankyně_Jana_Černochová']
+
+
+def test_topic_hash_uses_the_session_year(sessions):
+    # the year of the session parser is used, download_stenos is imported
+    assert sessions[1996]['lxml'].get_hash_for_topic("1-1.html#12") == "12"
+    session = session_parsers(2013, ['lxml'], sessions[1996]['lxml'].cache.path)['lxml']
+    assert session.get_hash_for_topic("1-1.html#q5") == "#q5"
+    session.fetcher.close()
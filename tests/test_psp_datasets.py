@@ -0,0 +1,69 @@
+"""
+Loads a small dataset written in each of the output formats of
+generate_pandas with psp_datasets.
+"""
+
+import sys
+
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+import psp_datasets
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("PSP_CZ_CACHE", str(tmp_path / "cache"))
+
+
+def dataset():
+    return pd.DataFrame({"session": [1, 1, 2],
+                         "date": pd.to_datetime(["2017-11-20", "2017-11-20", "2017-11-21"]),
+                         "name": ["Radek Vondráček", "Jana Černochová", "Jan Bartošek"],
+                         "function": ["Předseda PSP", "Poslankyně", "Místopředseda PSP"],
+                         "sex": ["M", "Ž", "M"],
+                         "party": ["ANO 2011", "ODS", "KDU-ČSL"],
+                         "tokens": [12, 7, 30]})
+
+
+def write(df, file_name):
+    suffix = psp_datasets.dataset_suffix(file_name)
+    if suffix == '.parquet':
+        df.to_parquet(file_name)
+    elif suffix == '.arrow':
+        df.to_feather(file_name)
+    else:
+        df.to_csv(file_name, sep='\t', index=False, compression=psp_datasets.TSV_COMPRESSION[suffix])
+
+
+@pytest.mark.parametrize("suffix", psp_datasets.DATASET_SUFFIXES)
+def test_load_every_format(tmp_path, suffix):
+    if suffix == '.tsv.zst':
+        pytest.importorskip("zstandard")
+    file_name = tmp_path / psp_datasets.period_file_name("2017-2021", suffix)
+    write(dataset(), file_name)
+
+    for _ in range(2):  # the second load of a TSV file reads the cached copy
+        df = psp_datasets.load_dataset(file_name, ["date", "name", "party", "tokens"], parse_dates=["date"])
+        assert list(df.columns) == ["date", "name", "party", "tokens"]
+        assert pd.api.types.is_datetime64_any_dtype(df["date"])
+        assert df["party"].dtype == "category"
+        assert df["name"].tolist() == dataset()["name"].tolist()
+        assert df["tokens"].tolist() == [12, 7, 30]
+
+
+def test_find_datasets_prefers_the_binary_formats(tmp_path):
+    for name in ("psp2013_2017.tsv.xz", "psp2017_2021.tsv.xz", "psp2017_2021.parquet",
+                 "psp2017_2021.xlsx", "speakers.tsv.xz"):
+        (tmp_path / name).touch()
+
+    assert psp_datasets.find_datasets(tmp_path) == {"2013-2017": tmp_path / "psp2013_2017.tsv.xz",
+                                                    "2017-2021": tmp_path / "psp2017_2021.parquet"}
+    with pytest.raises(FileNotFoundError):
+        psp_datasets.load_period("1993-1996", input_directory=tmp_path)
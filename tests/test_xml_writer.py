@@ -0,0 +1,90 @@
+"""
+Checks that PrettyXmlWriter writes the same document as serializing the
+ElementTree and pretty printing it with minidom.
+"""
+
+import io
+import sys
+
+from pathlib import Path
+from xml.dom import minidom
+from xml.etree.ElementTree import Element, SubElement, tostring
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from xml_writer import PrettyXmlWriter
+
+
+def streamed(element, indent):
+    fd = io.StringIO()
+    PrettyXmlWriter(fd, indent).write_tree(element)
+    return fd.getvalue()
+
+
+def pretty(element, indent):
+    return minidom.parseString(tostring(element)).toprettyxml(indent=indent)
+
+
+def corpus_document():
+    """A document of generate_corpus_input_files and generate_speakers_db"""
+    doc = Element('doc', {'id': '2017-2021_001_002', 'topic': 'Zpráva "A" & <B>'})
+    sp = SubElement(doc, 'sp', {'id': '1', 'speaker': 'Jan Novák', 'party': ''})
+    s = SubElement(sp, 's', {'id': '00001'})
+    s.text = "\nDobrý\tdobrý\tAAIS1----1A----\nden\tden\tNNIS1-----A----\n"
+    s = SubElement(sp, 's', {'id': '00002'})
+    s.text = "\n<&>\t<&>\tZ:-------------\r\n"
+    SubElement(doc, 'sp', {'id': '2'})
+    speaker = SubElement(doc, 'speaker', {'id': '3', 'gender': 'F'})
+    speaker.text = "Jana Nováková"
+    period = SubElement(speaker, 'period', {'years': '2017-2021'})
+    role = SubElement(period, 'role', {'id': '1'})
+    role.text = "poslankyně"
+    empty = SubElement(doc, 'empty')
+    empty.text = ""
+    return doc
+
+
+def escaped_document():
+    doc = Element('doc', {'quote': '"', 'amp': 'a & b', 'tags': '<x>'})
+    SubElement(doc, 'p').text = 'Tom & "Jerry" <3 > 2'
+    return doc
+
+
+def empty_document():
+    doc = Element('doc')
+    SubElement(doc, 'a')
+    SubElement(doc, 'b', {'id': '1'})
+    SubElement(SubElement(doc, 'c'), 'd').text = ""
+    return doc
+
+
+def nested_text_document():
+    doc = Element('doc')
+    doc.text = "text of the root"
+    outer = SubElement(doc, 'outer')
+    outer.text = "first line\r\nsecond line"
+    SubElement(outer, 'inner').text = "inner text"
+    SubElement(SubElement(outer, 'deep'), 'deeper').text = "\nleading and trailing\n"
+    return doc
+
+
+@pytest.mark.parametrize("indent", ["  ", "   ", "\t"])
+@pytest.mark.parametrize("document", [corpus_document, escaped_document,
+                                      empty_document, nested_text_document])
+def test_output_equal_to_minidom(document, indent):
+    element = document()
+    assert streamed(element, indent) == pretty(element, indent)
+
+
+def test_start_and_end_without_tree():
+    fd = io.StringIO()
+    xml = PrettyXmlWriter(fd, indent="  ")
+    xml.start("doc", {"id": "1"})
+    xml.element("s", {"id": "00001"}, "text")
+    xml.element("s", {"id": "00002"})
+    xml.end()
+
+    assert fd.getvalue() == ('<?xml version="1.0" ?>\n<doc id="1">\n'
+                             '  <s id="00001">text</s>\n  <s id="00002"/>\n</doc>\n')